@@ -0,0 +1 @@
+../rest/portal.py
\ No newline at end of file
@@ -0,0 +1,91 @@
+# Which OPC channel drives which FadeCandy, and which pixels of the frame
+# buffer belong to it.
+#
+# fcserver maps OPC channel 0 across all the boards (pixel 512 is the first
+# pixel of the second board, and so on).  If the fcserver config also gives
+# each board a channel of its own, e.g.
+#		"map": [
+#			[ 0, 512, 0, 512 ],		# channel 0, pixels 512-1023
+#			[ 2, 0, 0, 512 ]			# channel 2, the same 512 outputs
+#		]
+# then the writer can send one board at a time, and skip the boards whose
+# pixels did not change.  Without per-board channels, load() gives back None
+# and everything goes out on channel 0 as before.
+#
+# map entries are [ OPC channel, first OPC pixel, first output pixel, count ]
+
+import json
+
+from ledlib.helpers import debugprint, warnprint
+from ledlib.framebuffer import block_size
+
+class Board(object):
+	def __init__(self, serial, channel, base, size):
+		self.serial = serial
+		self.channel = channel
+		self.base = base				# first pixel in the frame buffer
+		self.size = size
+
+	# how many pixels, counting from this board's first pixel, need to go out
+	# to cover every dirty block on the board.  0 if the board is clean.
+	def dirty_end(self, dirty):
+		first = self.base // block_size
+		last = (self.base + self.size + block_size - 1) // block_size
+		changed = dirty[first:last].nonzero()[0]
+		if len(changed) == 0:
+			return 0
+		return min(self.size, (first + int(changed[-1]) + 1) * block_size - self.base)
+
+	def __str__(self):
+		return "board {0} channel {1} pixels {2}-{3}".format( \
+			self.serial, self.channel, self.base, self.base + self.size - 1)
+
+class ChannelMap(object):
+	def __init__(self, boards):
+		self.boards = boards
+
+	# the board that holds a given frame buffer pixel, or None
+	def board_of(self, pixel):
+		for board in self.boards:
+			if board.base <= pixel < board.base + board.size:
+				return board
+		return None
+
+def _board_from_device(device, entry):
+	channel, first_opc, first_out, count = entry
+	if first_opc != 0:
+		warnprint (("channelmap: channel", channel, "does not start at OPC pixel 0, ignored"))
+		return None
+	# find where these outputs sit on channel 0, i.e. in the frame buffer
+	for c0, c0_opc, c0_out, c0_count in device.get("map", []):
+		if c0 != 0:
+			continue
+		if c0_out <= first_out and first_out + count <= c0_out + c0_count:
+			return Board(device.get("serial", ""), channel, \
+						c0_opc + (first_out - c0_out), count)
+	warnprint (("channelmap: channel", channel, "is not covered by channel 0, ignored"))
+	return None
+
+def load(filename):
+	# read an fcserver config, return a ChannelMap or None
+	try:
+		with open(filename) as f:
+			config = json.load(f)
+	except (IOError, ValueError) as ex:
+		warnprint (("channelmap: could not read", filename, str(ex)))
+		return None
+
+	boards = []
+	for device in config.get("devices", []):
+		for entry in device.get("map", []):
+			if len(entry) != 4 or entry[0] == 0:
+				continue
+			board = _board_from_device(device, entry)
+			if board:
+				debugprint (("channelmap:", str(board)))
+				boards.append(board)
+
+	if len(boards) == 0:
+		return None
+	boards.sort(key=lambda b: b.base)
+	return ChannelMap(boards)
@@ -104,6 +104,6 @@ TEST_BLUE   = ((20,20,180), "blue")
 TEST_PURPLE = ((70,0,130),  "purple")
 TEST_BLACK    = ((20,20,20), "blackish")
 
-colortable["WHITISH"]		=	TEST_WHITE
-colortable["BLACKISH"]	=	TEST_BLACK
+colortable["WHITISH"]		=	TEST_WHITE[0]
+colortable["BLACKISH"]	=	TEST_BLACK[0]
 
@@ -0,0 +1,196 @@
+# The animation engine: one object, ticked by the frame clock, that runs the
+# pattern for every petal.  This replaces a thread per petal.
+#
+# Each petal is a small state machine with two layers, as in patterns.md:
+#   - the background: an infinite "state" pattern (the chase), and
+#   - the foreground: a finite "event" pattern (a flash for an attack).
+# Both are *_steps generators from ledlib/patterns.py.  While there is a
+# foreground pattern the background is paused; when the foreground is done
+# the background picks up where it left off.
+#
+# New LedActions are read off the petal's queue on every frame, not only when
+# the petal is idle.  An action with a higher priority than the running one
+# preempts it on the spot: the petal's pixels are put back the way they were
+# before the preempted pattern started, and the new pattern draws on this
+# very frame.  All of it lands in the frame buffer before the LED writer sends
+# the frame, so every petal moves on the same frame.
+
+import queue
+import time
+from collections import deque
+
+from ledlib import globaldata
+from ledlib.framebuffer import pixel_index
+
+# an infinite pattern that never waits would hang the clock thread
+max_steps_per_frame = 1000
+
+class PatternDone(Exception):
+	pass
+
+# step a pattern until it wants a later frame.  Returns the new due frame;
+# raises PatternDone when the pattern runs out.
+def step_pattern(pattern, due, frame, period):
+	steps = 0
+	while due <= frame:
+		if steps >= max_steps_per_frame:
+			return frame + 1
+		steps += 1
+		try:
+			wait = next(pattern)
+		except StopIteration:
+			raise PatternDone()
+		# a wait shorter than a frame just means several steps land on
+		# this frame; the fraction carries over so speeds stay right
+		if wait:
+			due += wait / period
+	return due
+
+class PetalState(object):
+
+	def __init__(self, reso, engine):
+		self.reso = reso
+		self.engine = engine
+		self.index = pixel_index(reso.pixelmap.list_of_lists_of_pixel_numbers)
+		self.pending = []					# LedActions waiting, highest priority first
+		self.foreground = None				# generator
+		self.action = None					# the LedAction the foreground is running
+		self.saved = None					# pixels from before the foreground started
+		self.due = 0.0						# frame number, fractional
+		self.background = None
+		self.background_due = 0.0
+
+	def take_actions(self, frame):
+		while True:
+			try:
+				action = self.reso.queue.get_nowait()
+			except queue.Empty:
+				return
+			self.reso.queue.task_done()
+
+			if self.action is not None and action.priority > self.action.priority:
+				# only something that shows preempts: an action with no
+				# pattern (DEFEND, for now) would just restart the running one
+				pattern = self.pattern_for(action)
+				if pattern is None:
+					continue
+				self.preempt()
+				self.start(action, frame, pattern)
+				continue
+			elif self.action is not None and action.action == self.action.action \
+					and not action.is_state():
+				# the same event is already on show
+				continue
+
+			if action.is_state():
+				# a state pattern reads the state when it starts, so it always
+				# runs again; only the newest one waiting is worth keeping
+				self.pending = [ p for p in self.pending if p.action != action.action ]
+
+			# keep pending in priority order, first come first served within one
+			place = len(self.pending)
+			for i in range(len(self.pending)):
+				if self.pending[i].priority < action.priority:
+					place = i
+					break
+			self.pending.insert(place, action)
+
+	def preempt(self):
+		self.reso.log.debug(" petal %s: %s preempted", self.reso.position, self.action.action)
+		self.foreground.close()
+		globaldata.all_the_pixels.set_values(self.index, self.saved)
+		if self.action.is_state() and \
+				not any(p.action == self.action.action for p in self.pending):
+			# state changes still have to happen, run it again later
+			self.pending.insert(0, self.action)
+		self.foreground = None
+		self.action = None
+
+	# the pattern for an action, or None if there is nothing to show
+	def pattern_for(self, action):
+		try:
+			return self.reso.pattern_for(action)
+		except Exception as ex:
+			self.reso.log.warning(" petal %s could not start %s: %s", \
+						self.reso.position, action.action, str(ex))
+			return None
+
+	def start(self, action, frame, pattern=None):
+		self.engine.latency.append(time.monotonic() - action.received)
+		if pattern is None:
+			pattern = self.pattern_for(action)
+		if pattern is None:
+			return
+		self.action = action
+		self.foreground = pattern
+		self.saved = globaldata.all_the_pixels.get_values(self.index)
+		self.due = frame
+
+	def finish(self, frame):
+		background = self.reso.background_for(self.action)
+		if background is not None:
+			if self.background is not None:
+				self.background.close()
+			self.background = background
+			self.background_due = frame
+		self.foreground = None
+		self.action = None
+
+	def tick(self, frame, period):
+		self.take_actions(frame)
+
+		while True:
+			if self.foreground is None:
+				if len(self.pending) == 0:
+					break
+				self.start(self.pending.pop(0), frame)
+				continue
+			try:
+				self.due = step_pattern(self.foreground, self.due, frame, period)
+				return
+			except PatternDone:
+				pass
+			except Exception as ex:
+				self.reso.log.warning(" petal %s pattern %s failed: %s", \
+							self.reso.position, self.action.action, str(ex))
+			self.finish(frame)
+
+		# nothing in the foreground: the background state pattern runs
+		if self.background is None:
+			return
+		try:
+			self.background_due = step_pattern(self.background, self.background_due, frame, period)
+		except PatternDone:
+			self.background = None
+		except Exception as ex:
+			self.reso.log.warning(" petal %s background failed: %s", \
+						self.reso.position, str(ex))
+			self.background = None
+
+class AnimationEngine(object):
+
+	def __init__(self, clock):
+		self.clock = clock
+		self.petals = []
+		# seconds from an LedAction being created to its pattern drawing
+		self.latency = deque(maxlen=1000)
+		# draw before anyone else (the LED writer) looks at this frame
+		clock.subscribe(self.tick, first=True)
+
+	def add(self, reso):
+		self.petals.append(PetalState(reso, self))
+
+	def tick(self, frame):
+		for petal in self.petals:
+			petal.tick(frame, self.clock.period)
+
+	def stats(self):
+		samples = sorted(self.latency)
+		if len(samples) == 0:
+			return { "actions": 0 }
+		return {
+			"actions": len(samples),
+			"latency_p50": samples[len(samples) // 2],
+			"latency_p95": samples[min(len(samples) - 1, len(samples) * 95 // 100)],
+			"latency_max": samples[-1],
+		}
@@ -6,14 +6,18 @@ from ledlib.portal import Resonator, Portal
 from ledlib.helpers import debugprint
 
 from ledlib import patterns
+from ledlib import framecache
 from ledlib import colordefs
+from ledlib import globaldata
+from ledlib import heartbeat
+from ledlib.engine import AnimationEngine
 
 from ledlib.colordefs import *
 
 
-import threading
 import logging
 import time
+import json
 # python3 calls it Queue
 import queue
 
@@ -35,6 +39,9 @@ class LedPortal(Portal):
 
 		verbose=True
 
+		# one engine runs every petal's patterns, off the frame clock
+		self.engine = AnimationEngine(heartbeat.get_clock())
+
 		# create the resos
 		self.resos = {}
 		for fc in range(4):								# 4 FAdecandy boards
@@ -47,6 +54,61 @@ class LedPortal(Portal):
 					v = portal_res.getValues()
 				self.resos[pos] = LedResonator(pos, self, fc, side, log, v)
 
+		# record every INIT blend now, off the frame clock, rather than the
+		# first time each one runs (see init_pattern)
+		framecache.warm_blends([ r.pixelmap.list_of_lists_of_pixel_numbers for r in self.resos.values() ], \
+					colordefs.colortable_faction, colordefs.colortable_level, 4, 200)
+
+	# Jarvis notification actions, and what the petals do about them
+	attack_actions = [ "attack" ]
+	state_actions = [ "portal_captured", "portal_neutralized", "virus_ada", "virus_jarvis", \
+					"resonator_add", "resonator_remove", "resonator_upgrade" ]
+	defend_actions = [ "recharge" ]
+
+	# a notification from Jarvis: a JSON object with the portal 'status' and
+	# either one 'action' or, batched, an ordered list of 'actions'.  Brings
+	# the portal up to date and hands every petal the matching LedActions, in
+	# order; returns them (empty if there is nothing to show).
+	def notify(self, notification, log):
+		status = notification.get("status", None)
+		if status:
+			# the same status as last time is not even parsed
+			self.setStatusRaw(status, log)
+			snap = self.snapshot
+			for pos, reso in self.resos.items():
+				r = snap.resonators.get(pos, None)
+				if r:
+					reso.level = r.level
+					reso.health = r.health
+				else:
+					reso.level = 0
+					reso.health = 0
+
+		action_strs = notification.get("actions", None)
+		if action_strs is None:
+			action_strs = [ notification.get("action", None) ]
+
+		issued = []
+		for action_str in action_strs:
+			a = self.led_action(action_str)
+			if a is None:
+				continue
+			for r in self.valid_positions:
+				self.resos[r].do_action(a)
+			issued.append(a)
+		return issued
+
+	# the LedAction for a Jarvis action string, or None
+	def led_action(self, action_str):
+		if action_str in self.attack_actions:
+			# the attacker is the other side
+			return LedAction('ATTACK', 3 - self.faction if self.faction else 0)
+		if action_str in self.state_actions:
+			return LedAction('INIT')
+		if action_str in self.defend_actions:
+			return LedAction('DEFEND', self.faction)
+		return None
+
 # Pixelstring
 # name
 # base
@@ -86,7 +148,10 @@ class PixelMap(object):
 
 	def __init__(self, fadecandy, side):
 		# TODO: validate side is 0 or 1
-		self.base = (512 * fadecandy) + (256 * side)
+		self.fadecandy = fadecandy
+		self.side = side
+		self.base = (globaldata.pixels_per_fadecandy * fadecandy) + \
+					(globaldata.pixels_per_fadecandy // 2 * side)
 		channels = [0, 64, 128, 192]		# TODO these should be in math
 		# TODO: better way for overrides
 
@@ -129,81 +194,28 @@ class PixelMap(object):
 		debugprint (" Wheee!!!")
 
 class LedAction():
+
+	# a new action preempts a running one with a lower priority.
+	# Preempted events (ATTACK...) are dropped, they are stale by then;
+	# state changes (INIT) are run again once the petal is free.
+	priorities = { "INIT": 1, "DEFEND": 2, "ATTACK": 3 }
+	states = [ "INIT" ]
+
 	def __init__(self,action,faction=0):
 		self.action = action
 		self.faction = faction
-		pass
-
-# AKA a petal
-# has a queue and a thread that reads the queue
-
-class LedResonatorThread( threading.Thread):
-	# todo: set more things
-	def __init__(self,  ledResonator):
-		threading.Thread.__init__(self)
-		self.ledResonator = ledResonator
-		self.log = ledResonator.log
-
-	# sets the leds to the init base state for the current colors
-	def init_pattern(self):
-		reso = self.ledResonator
-		self.log.debug(" init pattern: faction %d level %d ",reso.portal.faction,reso.level)
-		patterns.parallel_blend(reso.pixelmap.list_of_lists_of_pixel_numbers, \
-						colordefs.colortable_faction[reso.portal.faction], \
-						colordefs.colortable_level[reso.level], \
-						4, \
-						200)
-		# self.basic_chase_pattern("ww--ww--ww")
-		patterns.chase(reso.pixelmap.list_of_lists_of_pixel_numbers, \
-						"ww--ww--ww", -1, reso)
-
-	def flash_pattern(self, faction ):
-		reso = self.ledResonator
-
-		self.log.info(" FLASH pattern: faction %d",faction)
-
-		# 10 flashes in 10 seconds
-		if faction == 1:
-			rgb = colortable["ENL"]
-		elif faction == 2:
-			rgb = colortable["RES"]
-
-		patterns.flash(reso.pixelmap.list_of_lists_of_pixel_numbers, rgb, 10, 10.0)
-
-
-	def basic_chase_pattern(self, maskstring):
-		reso = self.ledResonator
-		self.log.info(" New basic CHASE pattern %s started.", maskstring)
-		patterns.chase(reso.pixelmap.list_of_lists_of_pixel_numbers, maskstring, -1)		# infinite chase
-
-
-	def run(self):
-		q = self.ledResonator.queue
-		reso = self.ledResonator # this is myself, for a shortcut
-		while True:
-			action = q.get()
-
-			self.log.debug( "LedResonator %s received action %s ",reso.position,str(action))
+		self.priority = self.priorities.get(action, 0)
+		self.received = time.monotonic()		# for the latency numbers
 
-			# TODO: Send the chase thread a stop signal.  Or have it check.
+	def is_state(self):
+		return self.action in self.states
 
-			if action.action == "INIT":
-				debugprint((" resonator ", reso.position, " received action ",action.action))
-				self.init_pattern()
+	def __str__(self):
+		return "{0}/{1}".format(self.action, self.faction)
 
-			if action.action == "ATTACK":
-				# faction is the number-form here
-				self.flash_pattern(action.faction)
-				pass
-
-			if action.action == "DEFEND":
-				pass
-
-			q.task_done() # tells other guy you are complete
-
-			# TODO: add here the background chase, and have it check the queue for new work
-			# frequently
-			
+# AKA a petal
+# has a queue of LedActions; the portal's animation engine reads the queue
+# and runs the patterns, on the frame clock
 
 class LedResonator(Resonator):
 
@@ -220,12 +232,10 @@ class LedResonator(Resonator):
 
 		self.pixelmap = PixelMap (fc, side)
 
-		# create the queue between this and the execution thread
+		# create the queue between this and the animation engine
 		self.queue = queue.Queue()
 
-		# may have to fix up argument so self gets to run
-		r_thread = self.thread = LedResonatorThread(self)
-		r_thread.start()
+		portal.engine.add(self)
 
 	def do_action(self,action):
 		self.queue.put(action)
@@ -240,5 +250,55 @@ class LedResonator(Resonator):
 			self.log.debug(" resonator %s has SOMETHING better to do",self.position)
 			return False
 
+	# the pattern (a generator, see patterns.py) to run for an action,
+	# or None if there is nothing to show for it
+	def pattern_for(self, action):
+
+		self.log.debug( "LedResonator %s received action %s ",self.position,str(action))
+
+		if action.action == "INIT":
+			debugprint((" resonator ", self.position, " received action ",action.action))
+			return self.init_pattern()
+
+		if action.action == "ATTACK":
+			# faction is the number-form here
+			return self.flash_pattern(action.faction)
+
+		if action.action == "DEFEND":
+			pass
+
+		return None
+
+	# the infinite pattern to leave running once an action's pattern is done,
+	# or None to keep whatever was running before
+	def background_for(self, action):
+		if action.action == "INIT":
+			return self.basic_chase_pattern("ww--ww--ww")
+		return None
+
+	# sets the leds to the init base state for the current colors
+	def init_pattern(self):
+		self.log.debug(" init pattern: faction %d level %d ",self.portal.faction,self.level)
+		return framecache.parallel_blend_steps(self.pixelmap.list_of_lists_of_pixel_numbers, \
+						colordefs.colortable_faction[self.portal.faction], \
+						colordefs.colortable_level[self.level], \
+						4, \
+						200)
+
+	def flash_pattern(self, faction ):
+
+		self.log.info(" FLASH pattern: faction %d",faction)
+
+		# 10 flashes in 10 seconds.  Not pre-rendered: it is two bulk writes
+		# a step already, and it restores whatever was under it.
+		rgb = colordefs.colortable_faction[faction]
+
+		return patterns.flash_steps(self.pixelmap.list_of_lists_of_pixel_numbers, rgb, 10, 10.0)
 
 
+	def basic_chase_pattern(self, maskstring):
+		self.log.info(" New basic CHASE pattern %s started.", maskstring)
+		# infinite chase: no thisreso, the engine pauses it for actions
+		# rather than have it stop whenever one is waiting
+		return framecache.chase_steps(self.pixelmap.list_of_lists_of_pixel_numbers, maskstring, -1, None)
+
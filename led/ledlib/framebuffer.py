@@ -0,0 +1,121 @@
+# The frame buffer: every pixel in the installation, as one contiguous
+# block of uint8 RGB values.
+#
+# Usage:
+#   fb = FrameBuffer(2048, (16,16,16))
+#   fb[12] = (200,0,0)							# single pixel, like the old list
+#   fb.set_color(pixel_index(lol), rgb)		# a whole petal in one shot
+#   client.put_pixels(fb)						# bytes go straight to the OPC client
+#
+# Writes are clamped to 0-255 here, so the OPC client never has to clamp.
+#
+# Every write also marks the 64-pixel blocks it touched (one FadeCandy
+# output each) as dirty, so the writer thread can skip a frame that has
+# not changed, or send only as far as the last change.
+
+import threading
+import numpy
+
+# pixels per FadeCandy output pin: the granularity of dirty tracking
+block_size = 64
+
+def pixel_index(pixel_numbers_lol):
+	# flatten a list-of-lists of pixel numbers into one index array
+	# (a PixelMap's list_of_lists_of_pixel_numbers, for example)
+	if isinstance(pixel_numbers_lol, numpy.ndarray):
+		return pixel_numbers_lol
+	if len(pixel_numbers_lol) == 0:
+		return numpy.zeros(0, dtype=numpy.intp)
+	return numpy.concatenate( \
+		[ numpy.asarray(strand, dtype=numpy.intp) for strand in pixel_numbers_lol ])
+
+def legal_rgb(rgb):
+	# anything we are handed - a triplet, a list of triplets, an array -
+	# comes back as uint8, clamped to the legal range
+	a = numpy.asarray(rgb)
+	if a.dtype == numpy.uint8:
+		return a
+	return numpy.clip(a, 0, 255).astype(numpy.uint8)
+
+class FrameBuffer(object):
+
+	def __init__(self, size, rgb=(0,0,0)):
+		self.size = size
+		self.pixels = numpy.empty((size, 3), dtype=numpy.uint8)
+		self.pixels[:] = legal_rgb(rgb)
+		self.dirty_lock = threading.Lock()
+		self.dirty = numpy.ones((size + block_size - 1) // block_size, dtype=bool)
+
+	# mark the blocks an index touches.  Called after the write, so a writer
+	# that sees the dirty mark also sees the new values.
+	def _touch(self, index):
+		if isinstance(index, slice):
+			lo, hi, step = index.indices(self.size)
+			if hi <= lo:
+				return
+			with self.dirty_lock:
+				self.dirty[lo // block_size : (hi - 1) // block_size + 1] = True
+			return
+		blocks = (numpy.asarray(index) % self.size) // block_size
+		with self.dirty_lock:
+			self.dirty[blocks] = True
+
+	# hand back the dirty blocks (a bool array, one per block) and clear them.
+	# None if nothing has changed since the last call.
+	def take_dirty(self):
+		with self.dirty_lock:
+			if not self.dirty.any():
+				return None
+			dirty = self.dirty.copy()
+			self.dirty[:] = False
+		return dirty
+
+	def mark_dirty(self):
+		with self.dirty_lock:
+			self.dirty[:] = True
+
+	def __len__(self):
+		return self.size
+
+	# a single index gives back a tuple, so old code that saved and restored
+	# pixels one at a time keeps working.  Slices and index arrays give back
+	# a copy of the (N,3) array.
+	def __getitem__(self, index):
+		if isinstance(index, (int, numpy.integer)):
+			r, g, b = self.pixels[index]
+			return (int(r), int(g), int(b))
+		return self.pixels[index].copy()
+
+	def __setitem__(self, index, rgb):
+		self.pixels[index] = legal_rgb(rgb)
+		self._touch(index)
+
+	def __iter__(self):
+		for r, g, b in self.pixels.tolist():
+			yield (r, g, b)
+
+	# set every pixel in the index array to a single color
+	def set_color(self, index, rgb):
+		self.pixels[index] = legal_rgb(rgb)
+		self._touch(index)
+
+	# set the pixels in the index array to previously captured values
+	# values is (N,3), in the same order as the index
+	def set_values(self, index, values):
+		self.pixels[index] = legal_rgb(values)
+		self._touch(index)
+
+	# capture the current values of the pixels in the index array
+	def get_values(self, index):
+		return self.pixels[index].copy()
+
+	def fill(self, rgb):
+		self.pixels[:] = legal_rgb(rgb)
+		self.mark_dirty()
+
+	# the raw bytes, in OPC order (r,g,b,r,g,b...), without a copy
+	def view(self):
+		return memoryview(self.pixels).cast('B')
+
+	def tobytes(self):
+		return self.pixels.tobytes()
@@ -0,0 +1,252 @@
+# Pre-rendered patterns.
+#
+# The patterns a petal runs come from a tiny set of inputs: 9 level colors,
+# 3 factions and a handful of PixelMap shapes.  Rather than redo the
+# mix/dimmer and strand-pointer arithmetic on every step of every run, a
+# pattern is drawn once into a scratch frame buffer, and what it wrote at
+# each step is kept: the pixels that changed, and their new values.
+# Playing it back is one set_values() per step.
+#
+# Recordings are in petal-local pixel numbers (strand 0 starts at 0, strand 1
+# right after it, ...), so every petal with the same strand lengths shares
+# them.  They live in an LRU cache, capped at globalconfig.framecache_budget
+# bytes.
+#
+# Recording is never done on the frame clock: a miss hands the pattern to
+# the cache's own thread to record, and this time the pattern runs live,
+# as patterns.py draws it.  The next run plays the recording.  warm_blends()
+# asks for the blends a flower uses up front, at startup.
+#
+# Usage, the same as the *_steps versions in patterns.py:
+#   from ledlib import framecache
+#   pattern = framecache.parallel_blend_steps(lol, rgb1, rgb2, 4, 200)
+#   framecache.cache.stats()
+
+import hashlib
+import queue
+import threading
+from collections import OrderedDict
+
+import numpy
+
+from ledlib import globalconfig
+from ledlib import globaldata
+from ledlib import patterns
+from ledlib.helpers import debugprint, warnprint
+from ledlib.framebuffer import FrameBuffer, pixel_index
+
+# a frame buffer that also remembers which pixels were written, and hands
+# back what changed since the last time it was asked
+class RecordingBuffer(FrameBuffer):
+
+	def __init__(self, start):
+		FrameBuffer.__init__(self, len(start))
+		self.pixels[:] = start
+		self.written = numpy.zeros(self.size, dtype=bool)
+		self.ever = numpy.zeros(self.size, dtype=bool)
+		self.last = self.pixels.copy()
+
+	def _touch(self, index):
+		self.written[index] = True
+
+	# (local pixel numbers, values) written since the last call.  A pixel
+	# written back to the value it already had is left out, unless it is
+	# the first write to it: the live buffer may hold anything before that.
+	def take_delta(self):
+		changed = (self.pixels != self.last).any(axis=1)
+		delta = self.written & (changed | ~self.ever)
+		self.ever |= self.written
+		self.written[:] = False
+		self.last[:] = self.pixels
+		where = delta.nonzero()[0]
+		return (where, self.pixels[where].copy())
+
+class Recording(object):
+
+	def __init__(self, deltas, waits):
+		self.deltas = deltas		# one (pixels, values) per step, plus the end state
+		self.waits = waits			# what the pattern yielded after each step
+		self.nbytes = sum(p.nbytes + v.nbytes for p, v in deltas)
+
+	def __len__(self):
+		return len(self.waits)
+
+# run a *_steps pattern from patterns.py to the end, on a scratch buffer
+# with the same strand lengths, starting from the given pixel values
+def record(steps_function, strand_lengths, args, start):
+	local_lol = []
+	base = 0
+	for length in strand_lengths:
+		local_lol.append(list(range(base, base + length)))
+		base += length
+
+	scratch = RecordingBuffer(start)
+	deltas = []
+	waits = []
+	for wait in steps_function(local_lol, *args, frame=scratch):
+		deltas.append(scratch.take_delta())
+		waits.append(wait)
+	deltas.append(scratch.take_delta())
+	return Recording(deltas, waits)
+
+# a generator, like the *_steps patterns: plays a recording into the frame
+# buffer at the given (global) pixel index
+def play(recording, index, fb=None):
+	fb = patterns.target(fb)
+	for step in range(len(recording)):
+		where, values = recording.deltas[step]
+		if len(where):
+			fb.set_values(index[where], values)
+		yield recording.waits[step]
+	where, values = recording.deltas[-1]
+	if len(where):
+		fb.set_values(index[where], values)
+
+class FrameCache(object):
+
+	def __init__(self, budget):
+		self.budget = budget				# bytes
+		self.lock = threading.Lock()
+		self.recordings = OrderedDict()	# key -> Recording, oldest first
+		self.nbytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.waiting = set()				# keys handed to the recorder
+		self.work = queue.Queue()
+		self.thread = None
+
+	# the recording for key, or None if it is not cached yet.  Then make()
+	# is handed to the recorder thread, and the caller runs the pattern live.
+	def get(self, key, make):
+		with self.lock:
+			recording = self.recordings.get(key)
+			if recording is not None:
+				self.recordings.move_to_end(key)
+				self.hits += 1
+				return recording
+			self.misses += 1
+			if key in self.waiting:
+				return None
+			self.waiting.add(key)
+			if self.thread is None:
+				self.thread = threading.Thread(target=self.run, name="framecache", daemon=True)
+				self.thread.start()
+		self.work.put((key, make))
+		return None
+
+	# the recorder thread
+	def run(self):
+		while True:
+			key, make = self.work.get()
+			try:
+				recording = make()
+				debugprint (("framecache: recorded", key[0], len(recording), "steps", recording.nbytes, "bytes"))
+				self.add(key, recording)
+			except Exception as ex:
+				warnprint (("framecache: could not record", key[0], str(ex)))
+			with self.lock:
+				self.waiting.discard(key)
+			self.work.task_done()
+
+	def add(self, key, recording):
+		if recording.nbytes > self.budget:
+			return
+		with self.lock:
+			if key not in self.recordings:
+				self.recordings[key] = recording
+				self.nbytes += recording.nbytes
+			while self.nbytes > self.budget:
+				oldkey, old = self.recordings.popitem(last=False)
+				self.nbytes -= old.nbytes
+				self.evictions += 1
+
+	# wait for everything asked for so far to be recorded
+	def join(self):
+		self.work.join()
+
+	def clear(self):
+		with self.lock:
+			self.recordings.clear()
+			self.nbytes = 0
+
+	def stats(self):
+		with self.lock:
+			return {
+				"entries": len(self.recordings),
+				"bytes": self.nbytes,
+				"budget": self.budget,
+				"hits": self.hits,
+				"misses": self.misses,
+				"evictions": self.evictions,
+				"recording": len(self.waiting),
+			}
+
+cache = FrameCache(globalconfig.framecache_budget)
+
+def _colors(rgb):
+	return tuple(int(c) for c in rgb)
+
+def _shape(list_of_lists_of_pixel_numbers):
+	return tuple(len(strand) for strand in list_of_lists_of_pixel_numbers)
+
+# Cached versions of the patterns in patterns.py, with the same arguments.
+# They are generators too, so nothing is looked up (or drawn) until the
+# first step: the engine may create one a while before it runs it.
+
+def _blend(shape, rgb1, rgb2, speed, steps):
+	args = (_colors(rgb1), _colors(rgb2), speed, steps)
+	# blend writes every pixel it shows, so the start state does not matter
+	return ("blend", shape) + args, \
+		lambda: record(patterns.parallel_blend_steps, shape, args, \
+					numpy.zeros((sum(shape), 3), dtype=numpy.uint8))
+
+def parallel_blend_steps (list_of_lists_of_pixel_numbers, \
+										rgb1, rgb2, speed=0, steps=100):
+	recording = cache.get(*_blend(_shape(list_of_lists_of_pixel_numbers), rgb1, rgb2, speed, steps))
+	if recording is None:
+		yield from patterns.parallel_blend_steps(list_of_lists_of_pixel_numbers, rgb1, rgb2, speed, steps)
+	else:
+		yield from play(recording, pixel_index(list_of_lists_of_pixel_numbers))
+
+# record, in the background, every blend from one of colors_from to one of
+# colors_to, for each petal shape
+def warm_blends(lols, colors_from, colors_to, speed=0, steps=100):
+	for shape in set(_shape(lol) for lol in lols):
+		for rgb1 in colors_from:
+			for rgb2 in colors_to:
+				cache.get(*_blend(shape, rgb1, rgb2, speed, steps))
+
+def parallel_fade_steps (list_of_lists_of_pixel_numbers, \
+										rgb_color_triplet, fade_ratio=0.5, speed=0, steps=100):
+	shape = _shape(list_of_lists_of_pixel_numbers)
+	args = (_colors(rgb_color_triplet), fade_ratio, speed, steps)
+	recording = cache.get(("fade", shape) + args, \
+				lambda: record(patterns.parallel_fade_steps, shape, args, \
+							numpy.zeros((sum(shape), 3), dtype=numpy.uint8)))
+	if recording is None:
+		yield from patterns.parallel_fade_steps(list_of_lists_of_pixel_numbers, \
+							rgb_color_triplet, fade_ratio, speed, steps)
+	else:
+		yield from play(recording, pixel_index(list_of_lists_of_pixel_numbers))
+
+def chase_steps (list_of_lists_of_pixel_numbers, maskstring, repeat, thisreso):
+	# the chase runs over whatever the petal shows when it starts, so that
+	# is part of the key.  One pass is recorded; repeats play it again.
+	# Until the recording is there, passes run live.
+	index = pixel_index(list_of_lists_of_pixel_numbers)
+	shape = _shape(list_of_lists_of_pixel_numbers)
+	start = globaldata.all_the_pixels.get_values(index)
+	key = ("chase", shape, maskstring, hashlib.sha1(start.tobytes()).hexdigest())
+	make = lambda: record(patterns.chase_steps, shape, (maskstring, 1, None), start)
+
+	loop = 0
+	while repeat < 1 or loop < repeat:
+		recording = cache.get(key, make)
+		if recording is None:
+			yield from patterns.chase_steps(list_of_lists_of_pixel_numbers, maskstring, 1, None)
+		else:
+			yield from play(recording, index)
+		loop += 1
+		if thisreso is not None and thisreso.hasinterrupt():
+			break
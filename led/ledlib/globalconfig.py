@@ -34,10 +34,23 @@ polling_interval = 0.1	# talk to Jarvis 10 times a second
 # write frames to the pixels every hundredth of a second
 framedelay				=	0.01
 
+# frames are only written when something changed, but resend the whole
+# frame at least this often anyway, in case fcserver was restarted
+keepalive					=	1.0
+
 # delay between writes when twinkling in a solid color
 twinkle						=	framedelay / 10
 
 max_brightness		=	0.8		# default for dimmer function
 
+# power budget per FadeCandy (ledlib/power.py): a frame that would draw more
+# than this is scaled down before it goes out.  One color channel at 255
+# draws about milliamps_per_channel, so a full-white pixel three times that.
+power_budget					=	10.0		# amps
+milliamps_per_channel	=	20
+
+# pre-rendered patterns (ledlib/framecache.py) kept, in bytes
+framecache_budget	=	16 * 1024 * 1024
+
 # starts out none, gets filled in
 log		= None
@@ -1,5 +1,6 @@
 # global data that more than one thread needs to access
 from ledlib import colordefs
+from ledlib.framebuffer import FrameBuffer
 
 pixels_per_fadecandy	= 512
 number_fadecandy			=	4
@@ -7,10 +8,17 @@ total_pixels					=	pixels_per_fadecandy * number_fadecandy
 
 basecolor							=	colordefs.colortable["DIM"]
 
-all_the_pixels				=	[ basecolor ] * total_pixels
+# uint8 (total_pixels,3) array; see ledlib/framebuffer.py
+all_the_pixels				=	FrameBuffer(total_pixels, basecolor)
 
 ledcontrol = ""
 
+# per-FadeCandy OPC channels, or None to send everything on channel 0
+channelmap = None
+
+# the LED writer's PowerLimiter, for metrics; see ledlib/power.py
+power = None
+
 # I'm sure there is an alternate universe where this is the proper place to put this function.
 def setpixel(index,rgb):
 	# print ("Setting pixel %n to %s", index, rgb)
@@ -3,3 +3,8 @@
 server="127.0.0.1"
 port="7890"
 
+
+# the config fcserver runs with (see ansible/files/fadecandy/fadecandy_server.conf),
+# read for its per-board OPC channels (see ledlib/channelmap.py).  If it has
+# none, or can't be read, everything goes out on channel 0.
+configfile = "/usr/local/bin/fcserver.json"
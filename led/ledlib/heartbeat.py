@@ -1,49 +1,198 @@
+# The frame clock: one thread that ticks every globalconfig.framedelay,
+# against absolute deadlines, so the frame rate does not drift with how
+# long a send took.  Everything that has to stay in sync hangs off it:
+#   - the LED writer subscribes and pushes a frame on every tick
+#   - the old heartbeat counter (0 .. heartmax, every heartrate seconds)
+#     is derived from the frame number
+#   - pattern code can subscribe(), or wait_frame() / sleep() on it
+#
+# Usage:
+#   from ledlib import heartbeat
+#   clock = heartbeat.get_clock()
+#   clock.subscribe(my_callback)		# called with the frame number, every frame
+#   heartbeat.sleep(0.5)					# frame-aligned sleep
+#   clock.stats()							# fps, late and dropped frames, jitter
+
+import math
+import threading
+import time
+from collections import deque
+
+from ledlib import globalconfig
+from ledlib.helpers import debugprint, warnprint
+
 heartbeat = 0
 
-def ticktock(startfrom=0):
-	from ledlib.globalconfig import heartbeat, heartmax, heartrate
-	global heartbeat
-	from time import sleep
-	from ledlib.helpers import debugprint
-	heartbeat = startfrom
-	while True:
-		if heartbeat >= heartmax:		# should never be >
-			heartbeat = 0
-			debugprint ("Tick loudly... ")
+clock = None
+
+class FrameClock(object):
+
+	def __init__(self, period, late_tolerance=None, history=1000):
+		self.period = period
+		# a tick later than this after its deadline counts as late
+		if late_tolerance is None:
+			late_tolerance = period / 2
+		self.late_tolerance = late_tolerance
+		self.frame = 0
+		self.late = 0
+		self.dropped = 0
+		self.running = False
+		self.stopped = False					# stop() was called: waiters give up
+		self.subscribers = []
+		self.condition = threading.Condition()
+		self.jitter = deque(maxlen=history)		# seconds past each deadline
+		self.ticks = deque(maxlen=history)		# when each frame went out
+		self.sleepers = threading.local()		# each thread's due frame, see sleep()
+
+	def subscribe(self, callback, first=False):
+		# callback(frame) is called from the clock thread on every frame.
+		# Keep it short: the next deadline is already running.
+		# first=True puts it ahead of everything already subscribed, for
+		# things that draw the frame rather than read it.
+		if first:
+			self.subscribers.insert(0, callback)
 		else:
-			heartbeat += 1
-		sleep (heartrate)
+			self.subscribers.append(callback)
 
-# def start_heartbeat():
-# 	# TODO: use import threading from python3
-# 	from _thread import start_new_thread
-# 	start_new_thread(ticktock, (0,))
+	def unsubscribe(self, callback):
+		if callback in self.subscribers:
+			self.subscribers.remove(callback)
 
-def wait_for_heartbeat(pulse):
-	from time import sleep
-	from ledlib.helpers import debugprint
-	from ledlib.globalconfig import heartbeat, heartmax, heartrate
+	# block until the next frame (or until frame number 'frame'), return it.
+	# Returns at once, with the frame it got to, once the clock is stopped.
+	def wait_frame(self, frame=None):
+		with self.condition:
+			if frame is None:
+				frame = self.frame + 1
+			while self.frame < frame and not self.stopped:
+				self.condition.wait()
+			return self.frame
+
+	# sleep, but wake up on a frame boundary so everyone stays in step.
+	# Each thread keeps a fractional due frame, as the animation engine
+	# does: a 1.5 frame sleep wakes after 2 frames, then 1, so a loop of
+	# sleeps keeps its speed.  A thread that comes back a frame or more
+	# late starts again from now.
+	def sleep(self, secs):
+		due = getattr(self.sleepers, 'due', None)
+		if due is None or self.frame - due >= 1:
+			due = float(self.frame)
+		due += secs / self.period
+		self.sleepers.due = due
+		return self.wait_frame(int(math.ceil(due)))
+
+	def run(self):
+		# designed to run in its own thread; only one run() per clock
+		with self.condition:
+			if self.running:
+				return
+			self.running = True
+			self.stopped = False
+		start = time.monotonic()
+		deadline = start
+		while self.running:
+			deadline += self.period
+			now = time.monotonic()
+			if deadline > now:
+				time.sleep(deadline - now)
+				now = time.monotonic()
+
+			lateness = now - deadline
+			self.jitter.append(lateness)
+			if lateness > self.late_tolerance:
+				self.late += 1
+			if lateness >= self.period:
+				# missed whole frames: skip them rather than rush to catch up
+				missed = int(lateness / self.period)
+				self.dropped += missed
+				deadline += missed * self.period
+
+			self.ticks.append(now)
+			with self.condition:
+				self.frame += 1
+				frame = self.frame
+			for callback in list(self.subscribers):
+				try:
+					callback(frame)
+				except Exception as ex:
+					warnprint (("frame clock: subscriber failed", callback, str(ex)))
+			with self.condition:
+				self.condition.notify_all()
+
+	# and wake up everyone waiting on it, so they don't wait forever
+	def stop(self):
+		with self.condition:
+			self.running = False
+			self.stopped = True
+			self.condition.notify_all()
+
+	# achieved frames per second, over the recent history
+	def fps(self):
+		if len(self.ticks) < 2:
+			return 0.0
+		elapsed = self.ticks[-1] - self.ticks[0]
+		if elapsed <= 0:
+			return 0.0
+		return (len(self.ticks) - 1) / elapsed
+
+	def jitter_percentile(self, percent):
+		samples = sorted(self.jitter)
+		if len(samples) == 0:
+			return 0.0
+		index = min(len(samples) - 1, int(len(samples) * percent / 100.0))
+		return samples[index]
+
+	def stats(self):
+		return {
+			"target_fps": 1.0 / self.period,
+			"fps": self.fps(),
+			"frames": self.frame,
+			"late": self.late,
+			"dropped": self.dropped,
+			"jitter_p50": self.jitter_percentile(50),
+			"jitter_p95": self.jitter_percentile(95),
+			"jitter_p99": self.jitter_percentile(99),
+		}
+
+# the heartbeat counter, derived from the frame number
+def _beat(frame):
 	global heartbeat
-	if pulse > heartmax:
-		debugprint (("Setting pulse to ", pulse, heartmax))
-		pulse = heartmax
-	while True:
-		debugprint (("Wait for absolute pulse:", heartbeat, pulse))
-		if heartbeat == pulse:
-			break
-		sleep (heartrate/4)
-
-def wait_for_heartbeat(percent):
-	from time import sleep
-	from ledlib.helpers import debugprint
-	from ledlib.globalconfig import heartbeat, heartmax, heartrate
-	if percent > 100:
-		debugprint (("Bad percent ", percent))
-		percent = 100
+	beat = int(frame * clock.period / globalconfig.heartrate) % (int(globalconfig.heartmax) + 1)
+	if beat == 0 and heartbeat != 0:
+		debugprint ("Tick loudly... ")
+	heartbeat = beat
+
+def get_clock():
+	global clock
+	if clock is None:
+		clock = FrameClock(globalconfig.framedelay)
+		clock.subscribe(_beat)
+	return clock
+
+def ticktock(startfrom=0):
+	# the heartbeat rides on the frame clock now: run the clock in this thread
+	# (returns straight away if something else is already running it)
+	get_clock().run()
+
+def start_heartbeat():
+	threading.Thread(target=ticktock).start()
+
+# frame-aligned sleep if the clock is running, plain sleep otherwise
+# (and for anything shorter than a frame, which has nothing to align to)
+def sleep(secs):
+	if clock is not None and clock.running and secs >= clock.period:
+		clock.sleep(secs)
+	else:
+		time.sleep(secs)
+
+def wait_for_heartbeat(pulse):
+	# wait for the heartbeat counter to reach an absolute pulse
+	if pulse > globalconfig.heartmax:
+		debugprint (("Setting pulse to ", pulse, globalconfig.heartmax))
+		pulse = globalconfig.heartmax
+	c = get_clock()
 	while True:
 		debugprint (("Wait for absolute pulse:", heartbeat, pulse))
-		if heartbeat == pulse:
+		if heartbeat == pulse or c.stopped:
 			break
-		sleep (heartrate/4)
-
-
+		c.wait_frame()
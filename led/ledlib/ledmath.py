@@ -1,5 +1,8 @@
 # ledmath.py
 
+import functools
+import numpy
+
 from ledlib import globalconfig
 
 RGB_min = 16		# below this we get flicker.  Disallow or use Fadecandy dither
@@ -136,3 +139,78 @@ def mix (rgb1, scale1, rgb2, scale2=0, maxbright=globalconfig.max_brightness):
 
 	pass
 
+
+# Array versions of the above, for a whole strand or petal at once.
+# rgb is anything numpy.asarray makes into (N,3): a list of triplets, a
+# frame buffer slice.  scale can be one number, or one per pixel.
+# They give back uint8 (N,3), the same values the single-triplet versions
+# give pixel by pixel (led/ledmathcheck.py checks that), so the arithmetic
+# below is done in the same order as above on purpose.
+
+def legal_intensity_array(values):
+	v = numpy.asarray(values, dtype=numpy.float64)
+	result = numpy.where(v < 8, 0, \
+				numpy.where(v < 16, 16, \
+				numpy.where(v < 255, numpy.trunc(v), 255)))
+	return result.astype(numpy.uint8)
+
+# lookup tables for dimmer_array(..., lut=True): for every channel value,
+# the scaled value, and what legal_intensity makes of it
+@functools.lru_cache(maxsize=64)
+def dimmer_table(scale):
+	scaled = numpy.arange(RGB_max + 1, dtype=numpy.float64)
+	if (scale < 1.00):
+		scaled = scaled * scale
+	return (scaled, legal_intensity_array(scaled))
+
+def _per_pixel(scale):
+	scale = numpy.asarray(scale, dtype=numpy.float64)
+	if scale.ndim == 1:
+		scale = scale[:,None]
+	return scale
+
+def _limit(scaled, maxbright):
+	# scaled is float (N,3); gives back the rows over maxbright, limited
+	average_brightness = (scaled[:,0] + scaled[:,1] + scaled[:,2]) / 3
+	percent_brightness = average_brightness / RGB_max
+	over = percent_brightness > maxbright
+	if over.any():
+		scaled = scaled.copy()
+		scaled[over] = scaled[over] * maxbright * percent_brightness[over,None]
+	return (scaled, over)
+
+def dimmer_array (rgb, scale=1.00, maxbright=globalconfig.max_brightness, lut=False):
+	# usage:  new = dimmer_array(fb[index])					# flatten down over-brightness
+	#					new = dimmer_array(fb[index], 0.6)			# 60%
+	#					new = dimmer_array(fb[index], fades)		# one scale per pixel
+	#					new = dimmer_array(fb[index], 0.6, lut=True)
+	# lut=True looks the scaled values up in a table instead of working them
+	# out; scale has to be one number and rgb whole numbers 0-255 for that.
+	rgb = numpy.asarray(rgb)
+	if lut:
+		scaled_table, intensity_table = dimmer_table(float(scale))
+		channels = rgb.astype(numpy.intp)
+		scaled, over = _limit(scaled_table[channels], maxbright)
+		result = intensity_table[channels]
+		if over.any():
+			result[over] = legal_intensity_array(scaled[over])
+		return result
+
+	scaled = rgb.astype(numpy.float64)
+	scale = _per_pixel(scale)
+	scaled = numpy.where(scale < 1.00, scaled * scale, scaled)
+	scaled, over = _limit(scaled, maxbright)
+	return legal_intensity_array(scaled)
+
+def mix_array (rgb1, scale1, rgb2, scale2=0, maxbright=globalconfig.max_brightness):
+	# rgb1 and rgb2 can be single triplets or (N,3); scale1 and scale2 can
+	# be single numbers or one per pixel, e.g. a whole blend in one call:
+	#   colors = mix_array(rgb1, 1.0 - numpy.arange(steps) / steps, rgb2)
+	scale1 = numpy.asarray(scale1, dtype=numpy.float64)
+	scale2 = numpy.asarray(scale2, dtype=numpy.float64)
+	scale2 = numpy.where(scale2 == 0, 1.0 - scale1, scale2)
+	rgb1 = numpy.asarray(rgb1, dtype=numpy.float64)
+	rgb2 = numpy.asarray(rgb2, dtype=numpy.float64)
+	mixed = numpy.trunc(rgb1 * _per_pixel(scale1) + rgb2 * _per_pixel(scale2))
+	# like mix(), which hands dimmer() its own default maxbright
+	return dimmer_array(mixed.reshape(-1,3))
@@ -1,7 +1,7 @@
 # All the code needed to implement pattern masking
 # only a subset of the clearest colors are used
 
-from ledlib.helpers import debugprint, verboseprint
+from ledlib.helpers import debugprint, verboseprint, warnprint
 from ledlib import colordefs
 
 # A mask is a list of colors and transparencies
@@ -40,9 +40,13 @@ class MaskPos(object):
 		else:
 			self.opacity = 0.00
 			self.rgb = (0,0,0)
-			log.info (" bad or unimplemented mask  %s, using transparent", maskchar)
-	def __apply_single(maskpos, rgb_triplet):
-		pass
+			warnprint ((" bad or unimplemented mask", maskchar, "using transparent"))
+	# the mask color laid over rgb_triplet, as opaque as this position is
+	def apply(self, rgb_triplet):
+		if self.opacity <= 0:
+			return tuple(rgb_triplet)
+		return tuple( int(round(self.opacity * m + (1 - self.opacity) * c)) \
+						for m, c in zip(self.rgb, rgb_triplet) )
 
 defaultmaskpos = MaskPos("-")
 
@@ -65,8 +69,8 @@ class Mask (object):
 		rgb_list_size = len(rgb_list)
 		scope = min(rgb_list_size, self.size)
 		result = [(150,150,150)] * scope			# dimension result list
-		for i in range(rgb_list_size):
-			result[i] = self.pos[i].__apply_single(rgb_list[i])
+		for i in range(scope):
+			result[i] = self.pos[i].apply(rgb_list[i])
 		# print ("mask apply result ", result, "size = ", rgb_list_size)
 		return result
 
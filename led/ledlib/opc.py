@@ -44,6 +44,13 @@ import socket
 import struct
 import sys
 
+# this file also works on its own, without ledlib (or numpy)
+try:
+    from ledlib.framebuffer import FrameBuffer, legal_rgb
+except ImportError:
+    FrameBuffer = None
+    legal_rgb = None
+
 class Client(object):
 
     def __init__(self, server_ip_port, long_connection=True, verbose=False):
@@ -137,6 +144,11 @@ class Client(object):
             For example: [(255, 255, 255), (0, 0, 0), (127, 0, 0)]
             Floats will be rounded down to integers.
             Values outside the legal range will be clamped.
+            A ledlib.framebuffer.FrameBuffer, or any bytes-like object of
+            already clamped r,g,b bytes, may be passed instead; that goes
+            through put_buffer() without any per-pixel work.  So may a
+            numpy array of shape (N, 3): one that isn't uint8 is clamped
+            to it first.
 
         Will establish a connection to the server as needed.
 
@@ -148,19 +160,20 @@ class Client(object):
         LED at a time (unless it's the first one).
 
         """
-        self._debug('put_pixels: connecting')
-        is_connected = self._ensure_connected()
-        if not is_connected:
-            self._debug('put_pixels: not connected.  ignoring these pixels.')
-            return False
-
-        # build OPC message
-        len_hi_byte = int(len(pixels)*3 / 256)
-        len_lo_byte = (len(pixels)*3) % 256
-        command = 0  # set pixel colors from openpixelcontrol.org
-
-        header = struct.pack("BBBB", channel, command, len_hi_byte, len_lo_byte)
-
+        if FrameBuffer is not None and isinstance(pixels, FrameBuffer):
+            # a FrameBuffer is already clamped and packed
+            return self.put_buffer(pixels.view(), channel)
+        if isinstance(pixels, (bytes, bytearray, memoryview)):
+            return self.put_buffer(pixels, channel)
+        if legal_rgb is not None and hasattr(pixels, 'dtype'):
+            # a numpy array: clamped to uint8 first if it is anything else
+            pixels = legal_rgb(pixels)
+            if pixels.ndim == 2 and pixels.shape[1] == 3:
+                if not pixels.flags.c_contiguous:
+                    pixels = pixels.copy()
+                return self.put_buffer(pixels, channel)
+
+        # the slow path: one pack per pixel
         pieces = [ struct.pack( "BBB",
                      min(255, max(0, int(r))),
                      min(255, max(0, int(g))),
@@ -168,23 +181,59 @@ class Client(object):
 
         if sys.version_info[0] == 3:
             # bytes!
-            message = header + b''.join(pieces)
+            body = b''.join(pieces)
         else:
             # strings!
-            message = header + ''.join(pieces)
+            body = ''.join(pieces)
+
+        return self.put_buffer(body, channel)
+
+    def put_buffer(self, data, channel=0):
+        """Send raw pixel bytes to the OPC server on the given channel.
+
+        data: a bytes-like object (bytes, bytearray, memoryview, or a
+            numpy uint8 array) holding r,g,b,r,g,b... already in the
+            range 0-255.  Nothing is clamped or copied: the header and
+            the body go out together with a single scatter-gather send.
 
-        self._debug('put_pixels: sending pixels to server')
+        Returns True or False, as put_pixels().
+
+        """
+        self._debug('put_buffer: connecting')
+        is_connected = self._ensure_connected()
+        if not is_connected:
+            self._debug('put_buffer: not connected.  ignoring these pixels.')
+            return False
+
+        body = memoryview(data).cast('B')
+
+        # build OPC message header
+        command = 0  # set pixel colors from openpixelcontrol.org
+        header = struct.pack(">BBH", channel, command, body.nbytes)
+
+        self._debug('put_buffer: sending pixels to server')
         try:
-            self._socket.send(message)
+            self._send(header, body)
         except socket.error:
-            self._debug('put_pixels: connection lost.  could not send pixels.')
+            self._debug('put_buffer: connection lost.  could not send pixels.')
             self._socket = None
             return False
 
         if not self._long_connection:
-            self._debug('put_pixels: disconnecting')
+            self._debug('put_buffer: disconnecting')
             self.disconnect()
 
         return True
 
-
+    def _send(self, header, body):
+        # sendmsg may come back short on a busy socket; finish off whatever
+        # is left with sendall rather than drop half a frame
+        if not hasattr(self._socket, 'sendmsg'):
+            self._socket.sendall(header + body.tobytes())
+            return
+        sent = self._socket.sendmsg([header, body])
+        if sent < len(header):
+            self._socket.sendall(header[sent:])
+            sent = len(header)
+        if sent - len(header) < body.nbytes:
+            self._socket.sendall(body[sent - len(header):])
@@ -1,10 +1,15 @@
 # opc interface, to hide the ugly.
 
-import opc
+from ledlib import opc
 import time
+import numpy
 from ledlib.hardcode import fcserverconfig
 from ledlib import globalconfig
 from ledlib import globaldata
+from ledlib import channelmap
+from ledlib import heartbeat
+from ledlib import power
+from ledlib.framebuffer import block_size
 from ledlib.helpers import debugprint
 
 def check_fcs(server,port):
@@ -31,6 +36,12 @@ def start_opc():
     # appears later
 		print('WARNING: could not connect to %s' % client_home)
 
+	globaldata.channelmap = channelmap.load(fcserverconfig.configfile)
+	if globaldata.channelmap:
+		print('sending per board on %d OPC channels' % len(globaldata.channelmap.boards))
+	else:
+		print('no per board channels in %s, sending on channel 0' % fcserverconfig.configfile)
+
 	return client
 
 def ledwrite(client, pixels):				# should be a method in a class
@@ -41,15 +52,56 @@ def ledwrite(client, pixels):				# should be a method in a class
 
 
 def ledwriteloop():
-	# designed to run in a very simple thread
-
-	while True:
-		# ugly workaround suggested on stack overflow
-		if not globalconfig.noop:
-			globaldata.ledcontrol.put_pixels(globaldata.all_the_pixels)
-			globaldata.ledcontrol.put_pixels(globaldata.all_the_pixels)
-		time.sleep(globalconfig.framedelay)
-		debugprint ("Tick... ")
+	# designed to run in a very simple thread: runs the frame clock, which
+	# calls the writer on every tick (and keeps the heartbeat going)
+	clock = heartbeat.get_clock()
+	clock.subscribe(LedWriter(globaldata.all_the_pixels))
+	clock.run()
+
+class LedWriter(object):
+	# called once per frame by the frame clock
+	# only writes when the frame buffer says something changed.  With a
+	# channel map, each FadeCandy gets its own message and clean boards are
+	# skipped; without one, a single channel 0 message goes out as far as the
+	# last changed block.  Either way, only as far as the last change: an OPC
+	# message always starts at the first pixel of its channel.
+	# Every globalconfig.keepalive seconds the whole frame goes out regardless.
+	# What goes out is what the power limiter (ledlib/power.py) lets through.
 
+	def __init__(self, frame):
+		self.frame = frame
+		if globaldata.channelmap:
+			self.boards = globaldata.channelmap.boards
+		else:
+			self.boards = [ channelmap.Board("all", 0, 0, frame.size) ]
+		self.last_full = 0.0
+		self.power = power.PowerLimiter(frame.size)
+		globaldata.power = self.power
 
+	def __call__(self, tick):
+		frame = self.frame
+		dirty = frame.take_dirty()
+		now = time.time()
+		if now - self.last_full >= globalconfig.keepalive:
+			dirty = numpy.ones(len(frame.dirty), dtype=bool)
+			self.last_full = now
 
+		if dirty is None or globalconfig.noop:
+			return
+
+		pixels, rescaled = self.power.limit(frame.pixels)
+		for group in rescaled.nonzero()[0]:
+			first = self.power.starts[group]
+			last = min(frame.size, first + self.power.group_size)
+			dirty[first // block_size : (last + block_size - 1) // block_size] = True
+		view = memoryview(pixels).cast('B')
+
+		for board in self.boards:
+			end = board.dirty_end(dirty)
+			if end == 0:
+				continue
+			body = view[board.base * 3 : (board.base + end) * 3]
+			# ugly workaround suggested on stack overflow
+			globaldata.ledcontrol.put_buffer(body, board.channel)
+			globaldata.ledcontrol.put_buffer(body, board.channel)
+		debugprint ("Tick... ")
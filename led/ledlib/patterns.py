@@ -1,11 +1,14 @@
 import random
 import time
+import numpy
 from ledlib.helpers import debugprint, verboseprint
 from ledlib import ledmath
 
 from ledlib import globalconfig
 from ledlib import globaldata
 from ledlib import masking
+from ledlib import heartbeat
+from ledlib.framebuffer import pixel_index
 
 static_patterns = ["SOLID", "BLEND", "DIM", "TEST"]
 moving_patterns	=	["TWINKLE", "FLOOD", "FLASH",
@@ -40,6 +43,33 @@ def randomcolor(maxbright=.5):
 	debugprint (("dimmed: ", rgb))
 	return rgb
 
+# Patterns come in two flavors.  The *_steps versions are generators: they
+# draw one step into the frame buffer, then yield how many seconds to wait
+# before the next step.  The animation engine (ledlib/engine.py) runs them
+# off the frame clock, all the petals in one thread.  The plain versions
+# are the same pattern, blocking the calling thread until it is done.
+
+#
+# The *_steps versions draw into frame if given one (see ledlib/framecache.py,
+# which records them), otherwise into globaldata.all_the_pixels.
+
+def run(pattern_steps):
+	for wait in pattern_steps:
+		if wait > 0:
+			heartbeat.sleep(wait)
+
+def target(frame):
+	if frame is None:
+		return globaldata.all_the_pixels
+	return frame
+
+def setpixel(fb, index, rgb):
+	try:
+		fb[index] = rgb
+		return 0
+	except IndexError:
+		return 1
+
 # this is an actual pattern.
 # it uses globalconfig.twinkle to figure out the speed
 # it covers "all the pixels"
@@ -49,8 +79,7 @@ def wake_up (first, size, rgb_color_triplet):
 	debugprint (rgb_color_triplet)
 
 	if globalconfig.fastwake:
-		for i in range(size):
-			globaldata.all_the_pixels[first+i] = rgb_color_triplet
+		globaldata.all_the_pixels[first:first+size] = rgb_color_triplet
 	else:
 		shuffled_index = [ 0 ] * size
 		for i in range (size):
@@ -61,15 +90,15 @@ def wake_up (first, size, rgb_color_triplet):
 			# even without a sleep this took visible time to run.  not a good sign.
 			# but setting to a single color was very fast
 			globaldata.all_the_pixels[first+shuffled_index[i]] = randomcolor()
-			time.sleep (globalconfig.twinkle/4)
+			heartbeat.sleep (globalconfig.twinkle/4)
 
-		time.sleep (10 * globalconfig.framedelay)
+		heartbeat.sleep (10 * globalconfig.framedelay)
 
 		# shuffle again
 		random.shuffle (shuffled_index)
 		for i in range (size):
 			globaldata.all_the_pixels[first+shuffled_index[i]] = rgb_color_triplet
-			time.sleep (globalconfig.twinkle)
+			heartbeat.sleep (globalconfig.twinkle)
 
 # 
 
@@ -86,58 +115,70 @@ def fade (list_of_pixel_numbers, rgb_color_triplet, fade_ratio=0.5, speed=0):
 		globaldata.all_the_pixels[list_of_pixel_numbers[i]]= \
 						dimmer(rgb_color_triplet,fade)
 		if speed > 0:
-			time.sleep(speed)
+			heartbeat.sleep(speed)
 
 # This goes from rgb1 to rgb2 along each list of pixel numbers
 
 def parallel_blend (list_of_lists_of_pixel_numbers, \
 										rgb1, rgb2, speed=0, steps=100):
+	run(parallel_blend_steps(list_of_lists_of_pixel_numbers, rgb1, rgb2, speed, steps))
+
+def parallel_blend_steps (list_of_lists_of_pixel_numbers, \
+										rgb1, rgb2, speed=0, steps=100, frame=None):
 	# pixel 0 is at 100%; pixel last is at fade_ratio;
 	# smooth gradient along multiple strands of LEDs of different lengths.
+	fb = target(frame)
 
 	strand_count = len(list_of_lists_of_pixel_numbers)
-	strand_sizes = [0] * strand_count
+	strands = [ pixel_index([strand]) for strand in list_of_lists_of_pixel_numbers ]
+	strand_sizes = [ len(strand) for strand in strands ]
 	strand_pointers = [0] * strand_count
 
 	debugprint (("blend between", rgb1, rgb2))
 
-	for strand in range(strand_count):
-		strand_sizes[strand] = len(list_of_lists_of_pixel_numbers[strand])
-		debugprint (("Strand ", strand, "size ", strand_sizes[strand], "begin", list_of_lists_of_pixel_numbers[strand][0]))
-		globaldata.all_the_pixels \
-					[list_of_lists_of_pixel_numbers[strand][0]]=rgb1
+	fb.set_color( \
+				[ strand[0] for strand in strands ], rgb1)
 
+	# every step's color in one go
+	colors = ledmath.mix_array(rgb1, 1.0 - numpy.arange(steps) / steps, rgb2)
 
 	for thisstep in range(steps):
 		# ignore the fencepost errors.  not going for exactness here.
 		# hue will vary due to rounding.  possibly a feature.
 		progress = thisstep/steps
-		newcolor = ledmath.mix(rgb1, 1.0-progress, rgb2)
+		newcolor = colors[thisstep]
 		debugprint (("blend", thisstep, newcolor))
+		# gather every pixel this step reaches, on every strand, and set
+		# them all at once
+		reached = []
 		for strand in range(strand_count):
-			while progress > (strand_pointers[strand] / strand_sizes[strand]):
-				globaldata.all_the_pixels \
-					[list_of_lists_of_pixel_numbers[strand][strand_pointers[strand]]] = \
-							newcolor
-				strand_pointers[strand] += 1
+			pointer = strand_pointers[strand]
+			while progress > (pointer / strand_sizes[strand]):
+				pointer += 1
+			if pointer > strand_pointers[strand]:
+				reached.append(strands[strand][strand_pointers[strand]:pointer])
+				strand_pointers[strand] = pointer
+		if reached:
+			fb.set_color(pixel_index(reached), newcolor)
 		if speed > 0:
-			time.sleep(speed/steps)
+			yield speed/steps
 
 	# nail in the last pixel in each strand
-	for strand in range(strand_count):
-		last_pixel = list_of_lists_of_pixel_numbers[strand][strand_sizes[strand]-1]
-		debugprint (("Last pixel, setting end of strand ", str(strand), "pixel number " , str(last_pixel), "rgb2", rgb2))
-		# globaldata.all_the_pixels \
-	#			[list_of_lists_of_pixel_numbers[strand][strand_sizes[strand]-1]]= \
-				#rgb2
-		globaldata.all_the_pixels[last_pixel] = rgb2
+	debugprint (("Last pixels, setting end of strands to rgb2", rgb2))
+	fb.set_color( \
+				[ strand[-1] for strand in strands ], rgb2)
 
 
 def chase (list_of_lists_of_pixel_numbers, maskstring, repeat, thisreso):
+	run(chase_steps(list_of_lists_of_pixel_numbers, maskstring, repeat, thisreso))
+
+def chase_steps (list_of_lists_of_pixel_numbers, maskstring, repeat, thisreso, frame=None):
 	# note that this should support a chase on only some components of a reso
 	# repeat = -1 : infinite repeat
 	# note:  if we were going to have to feed in the reso anyway, we could have used attributes of the
 	# reso and make this code a function inside the reso.  Oh well.  Lesson for next time.
+	fb = target(frame)
+
 	strand_count = len(list_of_lists_of_pixel_numbers)
 	strand_sizes = [0] * strand_count
 	strand_pointers = [0] * strand_count
@@ -149,7 +190,7 @@ def chase (list_of_lists_of_pixel_numbers, maskstring, repeat, thisreso):
 	# print ("entering chase loop with %s", chasemask.name)
 
 	def __single_chase(base_pixels, list_of_lists_of_pixel_numbers, chasemask, steps, speed):
-		print ("entering single chase with %s", chasemask.name)
+		# print ("entering single chase with %s", chasemask.name)
 		strand_pointers = [0] * strand_count
 		for thisstep in range(steps):
 			progress = thisstep/steps
@@ -163,7 +204,7 @@ def chase (list_of_lists_of_pixel_numbers, maskstring, repeat, thisreso):
 								#			[list_of_lists_of_pixel_numbers[strand][backpix]] = \
 								#			base_pixels[strand][backpix]
 								# print ("line 164")
-								globaldata.setpixel(list_of_lists_of_pixel_numbers[strand][backpix], base_pixels[strand][backpix])
+								setpixel(fb, list_of_lists_of_pixel_numbers[strand][backpix], base_pixels[strand][backpix])
 							# set current N pixels (if in bounds) to masked base
 							frontpix = strand_pointers[strand] - i
 							leadpix = min(frontpix + chasemask.size, strand_sizes[strand])
@@ -173,16 +214,12 @@ def chase (list_of_lists_of_pixel_numbers, maskstring, repeat, thisreso):
 											#[list_of_lists_of_pixel_numbers[strand][frontpix]] = \
 											#[200,50,50]
 								# print ("frontpix = ", frontpix, "leadpix= ", leadpix)
-								masked_pixels = chasemask.apply(globaldata.all_the_pixels[frontpix:leadpix])
-								# print ("line 175", "frontpix = ", frontpix, "i= ", i)
-								try:
-									globaldata.setpixel(list_of_lists_of_pixel_numbers[strand][frontpix], masked_pixels[i])
-								except:
-									# fencepost somewhere.
-									pass
+								# mask position i lands on this pixel, over its base color
+								setpixel(fb, list_of_lists_of_pixel_numbers[strand][frontpix], \
+											chasemask.pos[i].apply(base_pixels[strand][frontpix]))
 					strand_pointers[strand] += 1
 			if speed > 0:
-				time.sleep(speed/steps)
+				yield speed/steps
 # 		# clear out the final chase area
 # 		for i in range(chasemask.size):
 # 			backpix = strand_sizes[strand] - (chasemask.size - i)
@@ -191,12 +228,12 @@ def chase (list_of_lists_of_pixel_numbers, maskstring, repeat, thisreso):
 # 							[list_of_lists_of_pixel_numbers[strand][backpix]], \
 # 							base_pixels[strand][backpix])
 # 			if speed > 0:
-# 				time.sleep(speed/steps)
+# 				heartbeat.sleep(speed/steps)
 		# return to base state
-		print ("returning to base state")
+		# print ("returning to base state")
 		for strand in range(strand_count):
 			for i in range(strand_sizes[strand]):
-				globaldata.setpixel(list_of_lists_of_pixel_numbers[strand][i], base_pixels[strand][i])
+				setpixel(fb, list_of_lists_of_pixel_numbers[strand][i], base_pixels[strand][i])
 
 
 	base_pixels = [0,0,0] * strand_count * 1
@@ -207,17 +244,17 @@ def chase (list_of_lists_of_pixel_numbers, maskstring, repeat, thisreso):
 		base_pixels[strand] = [0,0,0] * strand_sizes[strand]
 		for pix in range(strand_sizes[strand]):
 			base_pixels[strand][pix] = \
-						globaldata.all_the_pixels[list_of_lists_of_pixel_numbers[strand][pix]]
+						fb[list_of_lists_of_pixel_numbers[strand][pix]]
 
 	if repeat >= 1:
 		for loop in range(repeat):
-			__single_chase(base_pixels, list_of_lists_of_pixel_numbers, chasemask, steps, speed)
-			if thisreso.hasinterrupt():
+			yield from __single_chase(base_pixels, list_of_lists_of_pixel_numbers, chasemask, steps, speed)
+			if thisreso is not None and thisreso.hasinterrupt():
 				break
 	else:
 		while True:
-			__single_chase(base_pixels, list_of_lists_of_pixel_numbers, chasemask, steps, speed)
-			if thisreso.hasinterrupt():
+			yield from __single_chase(base_pixels, list_of_lists_of_pixel_numbers, chasemask, steps, speed)
+			if thisreso is not None and thisreso.hasinterrupt():
 				break
 
 
@@ -225,8 +262,13 @@ def chase (list_of_lists_of_pixel_numbers, maskstring, repeat, thisreso):
 
 def parallel_fade (list_of_lists_of_pixel_numbers, \
 										rgb_color_triplet, fade_ratio=0.5, speed=0, steps=100):
+	run(parallel_fade_steps(list_of_lists_of_pixel_numbers, rgb_color_triplet, fade_ratio, speed, steps))
+
+def parallel_fade_steps (list_of_lists_of_pixel_numbers, \
+										rgb_color_triplet, fade_ratio=0.5, speed=0, steps=100, frame=None):
 	# pixel 0 is at 100%; pixel last is at fade_ratio;
 	# smooth gradient along multiple strands of LEDs of different lengths.
+	fb = target(frame)
 
 	strand_count = len(list_of_lists_of_pixel_numbers)
 	strand_sizes = [0] * strand_count
@@ -234,55 +276,58 @@ def parallel_fade (list_of_lists_of_pixel_numbers, \
 	for strand in range(strand_count):
 		strand_sizes[strand] = len(list_of_lists_of_pixel_numbers[strand])
 		debugprint (("Strand ", strand, "size ", strand_sizes[strand]))
-		globaldata.all_the_pixels \
+		fb \
 					[list_of_lists_of_pixel_numbers[strand][0]]=rgb_color_triplet
 
 
+	# every step's color in one go
+	brightnesses = 1.0 - fade_ratio * numpy.arange(steps) / steps
+	colors = ledmath.dimmer_array([ rgb_color_triplet ] * steps, brightnesses)
+
 	for thisstep in range(steps):
 		# ignore the fencepost errors.  not going for exactness here.
 		# hue will vary due to rounding.  possibly a feature.
-		brightness = 1.0 - fade_ratio*thisstep/steps
-		newcolor = ledmath.dimmer(rgb_color_triplet, brightness)
+		brightness = brightnesses[thisstep]
+		newcolor = colors[thisstep]
 		debugprint (("fade", thisstep, brightness, newcolor))
 		progress = thisstep/steps
 		for strand in range(strand_count):
 			while progress > (strand_pointers[strand] / strand_sizes[strand]):
-				globaldata.all_the_pixels \
+				fb \
 					[list_of_lists_of_pixel_numbers[strand][strand_pointers[strand]]] = \
 							newcolor
 				strand_pointers[strand] += 1
 		if speed > 0:
-			time.sleep(speed/steps)
+			yield speed/steps
 
 	# nail in the last pixel in each strand
 	newcolor = ledmath.dimmer(rgb_color_triplet, fade_ratio)
 	for strand in range(strand_count):
-		globaldata.all_the_pixels \
-				[list_of_lists_of_pixel_numbers[strand][strand_sizes[strand-1]]]= \
+		fb \
+				[list_of_lists_of_pixel_numbers[strand][strand_sizes[strand]-1]]= \
 				newcolor
 
 
 # set a list-of-lists to a single color
 def set_color(pixel_numbers_lol, rgb):
-	for strand in pixel_numbers_lol:
-		for p in strand:
-			debugprint(("set_color: setting to "))
-			globaldata.all_the_pixels[p]= rgb
+	globaldata.all_the_pixels.set_color(pixel_index(pixel_numbers_lol), rgb)
 
 
 
 # set a list-of-lists to a previously captured color
 #     SOURCE is the rgb_values_lol where values were stashed
+#            either a list-of-lists of triplets, or the (N,3) array
+#            that get_values() hands back
 #     DEST is the global memory array
 def set_values(pixel_numbers_lol, rgb_values_lol):
+	if not isinstance(rgb_values_lol, numpy.ndarray):
+		rgb_values_lol = numpy.concatenate( \
+			[ numpy.asarray(strand).reshape(-1,3) for strand in rgb_values_lol ])
+	globaldata.all_the_pixels.set_values(pixel_index(pixel_numbers_lol), rgb_values_lol)
 
-	strand_count = len(pixel_numbers_lol)
-
-	for strand_n in range(0,strand_count):
-		strand_len = len( pixel_numbers_lol[ strand_n ] )
-		for p_n in range(0,strand_len):
-			globaldata.all_the_pixels[ pixel_numbers_lol[strand_n][p_n] ] = rgb_values_lol [strand_n] [p_n]
-
+# capture the current colors of a list-of-lists, as an (N,3) array
+def get_values(pixel_numbers_lol):
+	return globaldata.all_the_pixels.get_values(pixel_index(pixel_numbers_lol))
 
 
 # flashes a particular RGB
@@ -291,21 +336,15 @@ def set_values(pixel_numbers_lol, rgb_values_lol):
 # speed is total amount of time in float seconds
 
 def flash ( pixel_numbers_lol, rgb, n_flashes, secs ):
+	run(flash_steps(pixel_numbers_lol, rgb, n_flashes, secs))
 
-	strand_count = len(pixel_numbers_lol)
-	strand_sizes = [0] * strand_count
-	for strand in range(strand_count):
-		strand_sizes[strand] = len(pixel_numbers_lol[strand])
+def flash_steps ( pixel_numbers_lol, rgb, n_flashes, secs, frame=None ):
+	fb = target(frame)
 
-	old_pixel_values = [0] * strand_count
+	index = pixel_index(pixel_numbers_lol)
 
-	# take a duplicate of all the old valuescopy the curent values of all the lists of lists
-	# you will have strands with RGB in them, not with pixel values
-	for strand_n in range(0,strand_count):
-		strand = pixel_numbers_lol[strand_n]
-		old_pixel_values[strand_n] = [0] * len(strand)
-		for idx in range(0,len(strand)):
-			old_pixel_values[strand_n][idx] = globaldata.all_the_pixels[strand[idx]]
+	# take a duplicate of all the old values, in one go
+	old_pixel_values = fb.get_values(index)
 
 	# todo: would really like the flashes to get faster instead of being all-the-same
 	flash_time = secs / n_flashes
@@ -315,20 +354,11 @@ def flash ( pixel_numbers_lol, rgb, n_flashes, secs ):
 	for i in range(0,n_flashes):
 
 		# set all the values to known number
-		set_color( pixel_numbers_lol, rgb)
+		fb.set_color(index, rgb)
 
-		time.sleep(flash_time)
+		yield flash_time
 
 		# set all the values back to what I grabbed before
-		set_values( pixel_numbers_lol, old_pixel_values)
-
-		time.sleep(flash_time)
-
-
-
-
-
-
-
-
+		fb.set_values(index, old_pixel_values)
 
+		yield flash_time
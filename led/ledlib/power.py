@@ -0,0 +1,70 @@
+# The power budget: white is very expensive (see architecture/modules.md),
+# and dimmer() only keeps single pixels under max_brightness.  A petal full
+# of bright pixels can still pull more than the supply can give.
+#
+# Once per frame, just before the OPC send, the LED writer hands the frame
+# to a PowerLimiter.  It estimates the current each group of pixels (one
+# FadeCandy, i.e. one supply, each) would draw, and if a group is over
+# globalconfig.power_budget it scales that group down uniformly.  The frame
+# buffer itself is left alone, so patterns that read their pixels back see
+# what they wrote; only what goes out on the wire is scaled.
+#
+# Estimate: each color channel draws globalconfig.milliamps_per_channel at
+# 255, proportionally less below that.
+#
+# Usage:
+#   limiter = PowerLimiter(frame.size)
+#   out, rescaled = limiter.limit(frame.pixels)	# out is what to send
+#   limiter.stats()
+
+import threading
+import numpy
+
+from ledlib import globalconfig
+from ledlib import globaldata
+
+class PowerLimiter(object):
+
+	def __init__(self, size, group_size=globaldata.pixels_per_fadecandy, \
+				budget=globalconfig.power_budget):
+		self.size = size
+		self.group_size = group_size
+		self.budget = budget						# amps per group
+		self.starts = numpy.arange(0, size, group_size)
+		groups = len(self.starts)
+		self.lock = threading.Lock()
+		self.amps = numpy.zeros(groups)			# estimated draw, before limiting
+		self.scales = numpy.ones(groups)			# what each group is scaled by
+		self.limited = numpy.zeros(groups, dtype=numpy.int64)	# frames scaled down
+		self.out = numpy.empty((size, 3), dtype=numpy.uint8)
+
+	# gives back (the pixels to send, the groups whose scale changed since the
+	# last frame).  A group whose scale changed has to go out in full, even
+	# where its pixels did not change.  If nothing is over budget, the pixels
+	# to send are the frame's own, not a copy.
+	def limit(self, pixels):
+		channel_sum = numpy.add.reduceat(pixels.reshape(-1), self.starts * 3, dtype=numpy.int64)
+		amps = channel_sum * (globalconfig.milliamps_per_channel / 255.0 / 1000.0)
+		scales = numpy.minimum(1.0, self.budget / numpy.maximum(amps, 1e-9))
+
+		with self.lock:
+			rescaled = scales != self.scales
+			self.amps = amps
+			self.scales = scales
+			self.limited += scales < 1.0
+
+		if (scales >= 1.0).all():
+			return (pixels, rescaled)
+
+		per_pixel = numpy.repeat(scales, self.group_size)[:self.size]
+		numpy.multiply(pixels, per_pixel[:,None], out=self.out, casting='unsafe')
+		return (self.out, rescaled)
+
+	def stats(self):
+		with self.lock:
+			return {
+				"budget_amps": self.budget,
+				"amps": [ round(float(a), 3) for a in self.amps ],
+				"scale": [ round(float(s), 3) for s in self.scales ],
+				"limited_frames": [ int(n) for n in self.limited ],
+			}
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# Checks that the array versions in ledmath (dimmer_array, mix_array,
+# legal_intensity_array) give exactly what the single-triplet versions
+# give, pixel by pixel, and times the two.
+#
+# Standalone, no hardware needed.  Exits 1 on the first mismatch.
+# Sample usage:
+# $ ./ledmathcheck.py
+# $ ./ledmathcheck.py --pixels 100000 --seed 7
+
+import argparse
+import sys
+import time
+
+import numpy
+
+from ledlib import ledmath
+from ledlib import colordefs
+
+def mismatch(what, args, expected, got):
+	print ("MISMATCH in", what, "for", args, ": scalar", expected, "array", got)
+	return 1
+
+def check_legal_intensity(values):
+	got = ledmath.legal_intensity_array(values)
+	for i in range(len(values)):
+		expected = ledmath.legal_intensity(values[i])
+		if got[i] != expected:
+			return mismatch("legal_intensity", values[i], expected, got[i])
+	return 0
+
+def check_dimmer(rgb, scales, maxbright):
+	per_pixel = ledmath.dimmer_array(rgb, scales, maxbright)
+	for scale in sorted(set(scales[:20].tolist())):
+		whole = ledmath.dimmer_array(rgb, scale, maxbright)
+		looked_up = ledmath.dimmer_array(rgb, scale, maxbright, lut=True)
+		for i in range(len(rgb)):
+			expected = ledmath.dimmer(tuple(rgb[i].tolist()), scale, maxbright)
+			if tuple(whole[i]) != expected:
+				return mismatch("dimmer", (rgb[i], scale), expected, whole[i])
+			if tuple(looked_up[i]) != expected:
+				return mismatch("dimmer, lut", (rgb[i], scale), expected, looked_up[i])
+	for i in range(len(rgb)):
+		expected = ledmath.dimmer(tuple(rgb[i].tolist()), scales[i], maxbright)
+		if tuple(per_pixel[i]) != expected:
+			return mismatch("dimmer, per pixel", (rgb[i], scales[i]), expected, per_pixel[i])
+	return 0
+
+def check_mix(rgb1, rgb2, scales1, scales2):
+	got = ledmath.mix_array(rgb1, scales1, rgb2, scales2)
+	for i in range(len(rgb1)):
+		expected = ledmath.mix(tuple(rgb1[i].tolist()), scales1[i], tuple(rgb2[i].tolist()), scales2[i])
+		if tuple(got[i]) != expected:
+			return mismatch("mix", (rgb1[i], scales1[i], rgb2[i], scales2[i]), expected, got[i])
+	# a whole blend between two table colors, the way the patterns use it
+	rgb1 = colordefs.colortable["ENL"]
+	rgb2 = colordefs.colortable["R8"]
+	steps = 200
+	got = ledmath.mix_array(rgb1, 1.0 - numpy.arange(steps) / steps, rgb2)
+	for thisstep in range(steps):
+		expected = ledmath.mix(rgb1, 1.0 - thisstep/steps, rgb2)
+		if tuple(got[thisstep]) != expected:
+			return mismatch("mix, blend", thisstep, expected, got[thisstep])
+	return 0
+
+def timed(f, *args, **kwargs):
+	start = time.perf_counter()
+	f(*args, **kwargs)
+	return time.perf_counter() - start
+
+def main(argv):
+	parser = argparse.ArgumentParser(description="Check the ledmath array versions against the scalar ones.")
+	parser.add_argument('--pixels', default=20000, type=int)
+	parser.add_argument('--seed', default=1, type=int)
+	commandline = parser.parse_args(argv)
+
+	random = numpy.random.RandomState(commandline.seed)
+	n = commandline.pixels
+
+	# every whole value, and then some around the edges
+	values = numpy.concatenate((numpy.arange(-2, 300, dtype=numpy.float64), \
+				random.uniform(-10, 300, n), [7.999999, 8.0, 15.999999, 16.0, 254.999999, 255.0]))
+	failed = check_legal_intensity(values)
+
+	rgb = random.randint(0, 256, (n, 3)).astype(numpy.uint8)
+	# scales on and around 1, including the same few a pattern would use
+	scales = numpy.concatenate((random.choice([0.0, 0.25, 0.5, 0.6, 1.0, 1.5], n // 2), \
+				random.uniform(0, 1.2, n - n // 2)))
+	for maxbright in (ledmath.globalconfig.max_brightness, 0.3, 1.0):
+		failed = failed or check_dimmer(rgb, scales, maxbright)
+
+	rgb2 = random.randint(0, 256, (n, 3)).astype(numpy.uint8)
+	scales2 = numpy.where(random.uniform(0, 1, n) < 0.5, 0, random.uniform(0, 1, n))
+	failed = failed or check_mix(rgb, rgb2, scales, scales2)
+
+	if failed:
+		return 1
+	print ("array versions match the scalar versions on %d pixels" % n)
+
+	rgb_list = [ tuple(p) for p in rgb.tolist() ]
+	scalar = timed(lambda: [ ledmath.dimmer(p, 0.6) for p in rgb_list ])
+	array = timed(ledmath.dimmer_array, rgb, 0.6)
+	lut = timed(ledmath.dimmer_array, rgb, 0.6, lut=True)
+	print ("dimmer, %d pixels: scalar %.2f ms, array %.2f ms, lut %.2f ms" % \
+				(n, scalar * 1000, array * 1000, lut * 1000))
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -145,7 +145,7 @@ def main(argv):
 	setup (argv)
 	log = globalconfig.log
 
-	# start a simple thread to asynchronously push the pixel array to the LEDs
+	# start the frame clock thread, which pushes the pixel array to the LEDs
 	let_there_be_light = Thread(target=opcwrap.ledwriteloop)
 	let_there_be_light.start()
 	log.debug ("Let there be light!")
@@ -154,9 +154,7 @@ def main(argv):
 	patterns.wake_up (0, globaldata.total_pixels, globaldata.basecolor)
 	log.debug ("... and there was light.")
 
-	# start a simple thread for asynchronous heartbeat
-	EKG = Thread(target=heartbeat.ticktock)
-	EKG.start()
+	# the global heartbeat rides on the frame clock started above
 	verboseprint ("Global heartbeat started.")
 
 	# create the LedPortal object - fundamental init
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# Micro-benchmark for the OPC client: how many full-installation frames
+# per second can we push through put_pixels?
+#
+# Compares the old path (a list of tuples, one struct.pack per pixel)
+# against the FrameBuffer / put_buffer path (one scatter-gather send).
+#
+# Standalone: it starts its own sink on localhost that reads and throws
+# away everything, so no fcserver or FadeCandy is needed.
+# Sample usage:
+# $ ./opcbench.py
+# $ ./opcbench.py --frames 2000
+
+import argparse
+import socket
+import sys
+import threading
+import time
+
+from ledlib import opc
+from ledlib import globaldata
+from ledlib.framebuffer import FrameBuffer
+
+def sink(listener):
+	conn, addr = listener.accept()
+	while conn.recv(65536):
+		pass
+	conn.close()
+
+def start_sink():
+	listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	listener.bind(("127.0.0.1", 0))
+	listener.listen(1)
+	t = threading.Thread(target=sink, args=(listener,), daemon=True)
+	t.start()
+	return listener.getsockname()[1]
+
+def run(client, pixels, frames):
+	start = time.perf_counter()
+	for i in range(frames):
+		client.put_pixels(pixels)
+	return frames / (time.perf_counter() - start)
+
+def main(argv):
+	parser = argparse.ArgumentParser(description="OPC put_pixels frames per second.")
+	parser.add_argument('--frames', default=500, type=int)
+	parser.add_argument('--pixels', default=globaldata.total_pixels, type=int)
+	commandline = parser.parse_args(argv)
+
+	port = start_sink()
+	client = opc.Client("127.0.0.1:%d" % port)
+	if not client.can_connect():
+		print ("could not connect to the sink")
+		return 1
+
+	rgb = (150,50,50)
+	tuples = [ rgb ] * commandline.pixels
+	fb = FrameBuffer(commandline.pixels, rgb)
+
+	# warm up the connection
+	run(client, fb, 10)
+
+	tuple_fps = run(client, tuples, commandline.frames)
+	buffer_fps = run(client, fb, commandline.frames)
+
+	print ("%d pixels, %d frames" % (commandline.pixels, commandline.frames))
+	print ("list of tuples:  %10.1f frames/sec" % tuple_fps)
+	print ("frame buffer:    %10.1f frames/sec" % buffer_fps)
+	print ("speedup:         %10.1fx" % (buffer_fps / tuple_fps))
+
+	client.disconnect()
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -132,7 +132,7 @@ def main(argv):
 
 	ledportal.setup(argv)
 
-	# start a simple thread to asynchronously push the pixel array to the LEDs
+	# start the frame clock thread, which pushes the pixel array to the LEDs
 	let_there_be_light = Thread(target=opcwrap.ledwriteloop)
 	let_there_be_light.start()
 	verboseprint ("Let there be light!")
@@ -141,9 +141,7 @@ def main(argv):
 	patterns.wake_up (0, globaldata.total_pixels, globaldata.basecolor)
 	verboseprint ("... and there was light.")
 
-	# start a simple thread for asynchronous heartbeat
-	EKG = Thread(target=heartbeat.ticktock)
-	EKG.start()
+	# the global heartbeat rides on the frame clock started above
 	verboseprint ("Global heartbeat started.")
 
 	thisledportal = LedPortal( None, globalconfig.log)
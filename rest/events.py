@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+### VERY MUCH PYTHON 3 !!!
+
+#
+# The Jarvis event stream: portal changes and actions, pushed to whoever
+# keeps a connection open, instead of one POST per event per driver.
+#
+# Jarvis side: an EventLog. Every poll that changes something is published
+# as one event, with a sequence number:
+#   { "seq": 12, "status": <portal string>, "actions": [ ... ],
+#     "what_changed": { ... }, "time": "..." }
+# which is the same shape as a batched /portal notification, so drivers
+# handle both the same way. The last few hundred events are kept, so a
+# client that reconnects with ?since=<last seq it saw> gets what it missed.
+# If it has been gone too long for that, or is new (?since=0), it gets a
+# "sync" event with the current status and no actions, then carries on
+# from there.
+#
+# Driver side: follow() keeps a WebSocket open to Jarvis, reconnecting with
+# backoff and resuming where it left off, and hands every event to a
+# callback.
+#
+
+import asyncio
+import collections
+import json
+
+import aiohttp
+
+class EventLog:
+
+    def __init__(self, history=500, depth=256):
+        self.seq = 0
+        self.events = collections.deque(maxlen=history)
+        self.depth = depth              # per subscriber, before we give up on it
+        self.subscribers = set()
+        self.published = 0
+        self.overflows = 0
+
+    # events are serialized once, here: the history and the subscriber
+    # queues hold (seq, JSON string). Returns the JSON string.
+    def publish(self, event):
+        self.seq += 1
+        event['seq'] = self.seq
+        entry = (self.seq, json.dumps(event))
+        self.events.append(entry)
+        self.published += 1
+        for q in list(self.subscribers):
+            try:
+                q.put_nowait(entry)
+            except asyncio.QueueFull:
+                # too slow to keep up: cut it off, it resumes from the history
+                self.overflows += 1
+                self.subscribers.discard(q)
+                q.overflowed = True
+        return entry[1]
+
+    # the (seq, JSON) events after seq, oldest first; None if some are gone
+    # (or seq is from before a restart) and the caller has to sync instead.
+    # seq 0 is a client that has seen nothing yet: it syncs too, rather than
+    # replaying the whole history (old attacks and captures) as if new.
+    def since(self, seq):
+        if seq <= 0 or seq > self.seq:
+            return None
+        if seq == self.seq:
+            return []
+        if len(self.events) == 0 or self.events[0][0] > seq + 1:
+            return None
+        return [ e for e in self.events if e[0] > seq ]
+
+    def subscribe(self):
+        q = asyncio.Queue(maxsize=self.depth)
+        q.overflowed = False
+        self.subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        self.subscribers.discard(q)
+
+    def stats(self):
+        return { 'seq': self.seq, 'published': self.published,
+                 'subscribers': len(self.subscribers), 'overflows': self.overflows }
+
+#
+# Follow the stream from a driver. handle(event) is called for every event,
+# in order. Runs until cancelled.
+#
+async def follow(url, handle, log, since=0, retry=1.0, max_retry=30.0):
+    seq = since
+    delay = retry
+    while True:
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.ws_connect("%s?since=%d" % (url, seq), heartbeat=30) as ws:
+                    log.info(" following events at %s from %d",url,seq)
+                    delay = retry
+                    async for msg in ws:
+                        if msg.type != aiohttp.WSMsgType.TEXT:
+                            break
+                        event = json.loads(msg.data)
+                        seq = event.get('seq', seq)
+                        try:
+                            handle(event)
+                        except Exception as ex:
+                            log.warning(" event %d not handled: %s",seq,str(ex))
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            log.warning(" event stream %s: %s, retrying in %.1f seconds",url,str(ex),delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_retry)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+### VERY MUCH PYTHON 3 !!!
+
+#
+# Checks EventLog.since(), which decides what a driver connecting to the
+# Jarvis event stream is sent first: the events it missed, or a sync.
+#
+# A driver that has just started (?since=0) must get a sync, never the
+# history: otherwise every LED or sound restart replays old attacks.
+#
+# Standalone, no Jarvis needed. Exits 1 on the first failure.
+# Sample usage:
+# $ python eventscheck.py
+#
+
+import sys
+
+from events import EventLog
+
+def check(what, got, expected):
+    if got != expected:
+        print ("FAILED:", what, "gave", got, "expected", expected)
+        return 1
+    return 0
+
+def seqs(events):
+    return None if events is None else [ seq for seq, data in events ]
+
+def main():
+    failed = 0
+
+    log = EventLog(history=10)
+    failed += check("since(0), nothing published", seqs(log.since(0)), None)
+
+    for i in range(5):
+        log.publish({'actions': ['attack']})
+    failed += check("since(0), history not wrapped", seqs(log.since(0)), None)
+    failed += check("since(2)", seqs(log.since(2)), [3, 4, 5])
+    failed += check("since(5), up to date", seqs(log.since(5)), [])
+    failed += check("since(9), from before a restart", seqs(log.since(9)), None)
+
+    for i in range(10):
+        log.publish({'actions': ['attack']})
+    failed += check("since(0), history wrapped", seqs(log.since(0)), None)
+    failed += check("since(2), gone from the history", seqs(log.since(2)), None)
+    failed += check("since(5), oldest kept", seqs(log.since(5)), list(range(6, 16)))
+
+    if failed:
+        return 1
+    print ("EventLog.since: all good")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -45,6 +45,7 @@ import json
 import argparse
 
 import textwrap
+import collections
 
 from aiohttp import web
 import aiohttp
@@ -52,39 +53,139 @@ import asyncio
 import async_timeout
 
 # import local shared code
-from portal import Resonator, Portal
+from portal import Resonator, Portal, snapshot_response
+from events import EventLog
+from persist import FileWriter
 
 class Notification:
     # app is my app, that has some interesting parameters
     # payload is a string to be delivered JSON style
-    # URL is the remote endpoint to notify
+    # driver is the remote endpoint to notify (see Driver)
 
-    def __init__(self, app, url, payload):
+    def __init__(self, app, driver, payload):
         self.app = app
         self.payload = payload
-        self.url = url
+        self.driver = driver
+        self.url = driver.url
+        self.queued = time.monotonic()
 
     # queueing: if it's full just don't notify
     def enqueue(self):
-        q = self.app['queue']
         try:
-            q.put_nowait(self)
-        except QueueFull:
-            logger.warning(" can't queue for notification ")
+            self.driver.queue.put_nowait(self)
+        except asyncio.QueueFull:
+            self.driver.dropped += 1
+            logger.warning(" can't queue for notification to %s, queue full ",self.driver.name)
             pass
 
     async def notify(self):
-        session = self.app['session']
+        session = self.driver.session
         logger.debug(" Notification: notify posting JSON to endpoint %s",self.url)
-        with async_timeout.timeout(1.0):
+        with async_timeout.timeout(self.driver.timeout):
             headers = {'content-type': 'application/json; charset=utf-8' }
             async with session.post(self.url, data=self.payload) as resp:
             # with session.post(self.url) as resp:
                 logger.debug("post notification: response code: %d",resp.status)
                 if resp.status != 200:
                     logger.warning(" post: response is not 200, is %d, ignoring",resp.status)
-                    return 
-        return 
+                    return False
+        return True
+
+#
+# One of the units that get told about portal changes (sound, led...).
+# Each has its own bounded queue, its own worker task and its own
+# connection pool, so a slow or hung unit only ever holds up itself.
+#
+
+class Driver:
+
+    def __init__(self, name, url, config):
+        self.name = name
+        self.url = url
+        self.queue = asyncio.Queue(maxsize=config.get("driver_queue_depth", 32))
+        self.timeout = config.get("driver_timeout", 1.0)
+        self.connections = config.get("driver_connections", 2)
+        self.session = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.latency = collections.deque(maxlen=1000)   # queued to answered, seconds
+
+    # keep-alive connections to this driver only, reused between posts
+    def connector(self):
+        return aiohttp.TCPConnector(limit=self.connections, keepalive_timeout=30)
+
+    def stats(self):
+        samples = sorted(self.latency)
+        s = { 'url': self.url, 'queued': self.queue.qsize(),
+              'sent': self.sent, 'failed': self.failed, 'dropped': self.dropped }
+        if samples:
+            s['latency_p50'] = samples[len(samples) // 2]
+            s['latency_p95'] = samples[min(len(samples) - 1, len(samples) * 95 // 100)]
+            s['latency_max'] = samples[-1]
+        return s
+
+# drivers listed in "stream_drivers" follow /events/ws instead of being posted to
+def create_drivers(g_config):
+    drivers = collections.OrderedDict()
+    streaming = g_config.get("stream_drivers", [])
+    for d in g_config["drivers"]:
+        if d not in streaming:
+            drivers[d] = Driver(d, g_config[d], g_config)
+    return drivers
+
+#
+# How often to poll the Tecthulu. Fast while things are happening (an
+# attack is a burst of changes), the configured tecthulu_poll normally,
+# slow once the portal has been idle a while, and backing off
+# exponentially while the Tecthulu can't be reached.
+#
+
+class Poller:
+
+    def __init__(self, g_config):
+        self.period = g_config["tecthulu_poll"]
+        self.fast = g_config.get("tecthulu_poll_fast", self.period / 4)
+        self.idle = g_config.get("tecthulu_poll_idle", self.period * 4)
+        self.max_backoff = g_config.get("tecthulu_poll_max_backoff", 30.0)
+        self.active_window = g_config.get("tecthulu_active_window", 10.0)  # seconds after a change
+        self.idle_window = g_config.get("tecthulu_idle_window", 60.0)      # seconds without one
+        self.interval = self.period
+        self.last_change = time.monotonic()
+        self.failures = 0
+        self.etag = None            # from the last 200, sent back as If-None-Match
+        self.polls = 0
+        self.changed = 0
+        self.unchanged = 0          # same body, not even parsed
+        self.not_modified = 0       # 304s
+        self.errors = 0
+
+    def changes(self):
+        self.changed += 1
+        self.last_change = time.monotonic()
+
+    def failed(self):
+        self.errors += 1
+        self.failures += 1
+
+    # after a poll: how long until the next one
+    def next_interval(self):
+        if self.failures:
+            self.interval = min(self.max_backoff, self.period * (2 ** self.failures))
+            return self.interval
+        quiet = time.monotonic() - self.last_change
+        if quiet < self.active_window:
+            self.interval = self.fast
+        elif quiet > self.idle_window:
+            self.interval = self.idle
+        else:
+            self.interval = self.period
+        return self.interval
+
+    def stats(self):
+        return { 'interval': self.interval, 'polls': self.polls, 'changed': self.changed,
+                 'unchanged': self.unchanged, 'not_modified': self.not_modified,
+                 'errors': self.errors, 'failures_in_a_row': self.failures }
 
 #
 # Task that asynchronously polls the Techthulu module
@@ -93,18 +194,18 @@ class Notification:
 # and update the stored file
 #
 
-# write the portal to disk - since it's local, do it synchronously
-def write_file( filename, portal_str, mode="w" ):
-    
-    logger.debug(" writing file %s string %s",filename,portal_str)
-
-    # open the file, write it
-    with open(filename, mode) as f:
-        f = open(filename, mode)
-        f.write(portal_str)
-        f.close()
-        
-    logger.debug(" wrote to file ")
+# the portal file, and in DEBUG the trace of notifications: written off
+# the event loop, see persist.py
+def create_writers(app):
+    g_config = app['config']
+    delay = g_config.get("persist_delay", 0.2)
+    writers = {}
+    writers['portal'] = FileWriter(g_config["portalfile"], app['log'],
+                                   delay=delay, fsync=g_config.get("persist_fsync", 0))
+    if app['debug'] == "DEBUG":
+        writers['trace'] = FileWriter(g_config["tracefile"], app['log'], append=True,
+                                      delay=delay, fsync=-1)
+    return writers
 
 #
 # Post to an endpoint
@@ -138,84 +239,107 @@ async def fetch(session, url):
 
 async def portal_status(session, url, app):
 
-    # get urls to post responses to
+    # the drivers to post responses to
     g_config = app["config"]
-    driver_urls = []
-    for d in g_config["drivers"]:
-        driver_urls.append( g_config[d] )
+    drivers = app['drivers']
+    poller = app['poller']
+
+    headers = {}
+    if poller.etag:
+        headers['If-None-Match'] = poller.etag
 
     with async_timeout.timeout(2):
-        async with session.get(url) as resp:
-            logger.debug(" response code: %s content-type %s",resp.status, resp.headers['Content-Type'])
+        async with session.get(url, headers=headers) as resp:
+            logger.debug(" response code: %s content-type %s",resp.status, resp.headers.get('Content-Type'))
+            if resp.status == 304:
+                poller.not_modified += 1
+                return None
             if resp.status != 200:
+                poller.failed()
                 return None
-            resp_type = resp.headers['Content-Type']
-            if resp_type.find("text/plain"):
-                resp_text = await resp.text()
-            elif resp_type.find("application/json"):
-                resp_text = await resp.text()
-            else:
+            poller.etag = resp.headers.get('ETag', None)
+
+            body = await resp.read()
+
+            resp_type = resp.headers.get('Content-Type', "")
+            if resp_type.find("text/plain") < 0 and resp_type.find("application/json") < 0:
                 logger.warning(" unknown content type %s , will treat as text",resp_type)
-                resp_text = await resp.text()
 
             # important log! What did TecThulu say???
-            logger.debug(" status: response text %s",resp_text)
-            
-            # parse the json object
+            logger.debug(" status: response text %s",body)
+
+            # Determine if there are differences between the old and new object
+            # what_changed is a dict with things that changed
+            portal = app['portal']
+
+            # this sets the status and returns what changed.  The same bytes
+            # as last time are not even parsed, see Portal.setStatusRaw
+            unchanged = portal.raw_unchanged
             try:
-                status_obj = json.loads(resp_text)
+                actions, what_changed = portal.setStatusRaw(body, logger)
             except ValueError:
-                logger.warning("portal_status: could not decode JSON response string from thulu %s",resp_text)
+                logger.warning("portal_status: could not decode JSON response string from thulu %s",body)
+                poller.failed()
                 return None
             except Exception as ex:
                 logger.warning(" could not decode JSON string, exception %s ",str(ex))
+                poller.failed()
                 return None
+            poller.unchanged += portal.raw_unchanged - unchanged
 
-            # logger.debug(" json load success ")
-
-            # Determine if there are differences between the old and new object
-            # what_changed is a dict with things that changed
-            portal = app['portal']
-
-            # this sets the status and returns what changed
-            actions, what_changed = portal.setStatusJson(status_obj, logger)
-
-            # If the object has changed and actions are known,
-            if actions and what_changed:
+            # If the object has changed: the file and the event stream get
+            # every change, even one with no actions (mods), so they agree
+            # with /status/json. Drivers are only posted actions.
+            if what_changed:
+                actions = actions or []
                 logger.info(" something changed! %s ", what_changed)
+                poller.changes()
 
                 # get a timestamp
                 timestamp = str(datetime.datetime.now())
 
                 # get the encoded string only once
-                with portal.lock:
-                    portal_str = str(portal)
+                portal_str = str(portal.snapshot)
 
                 logger.debug(" changed: got string %s ",portal_str)
 
-                # write to the file
-                write_file(g_config["portalfile"], portal_str)
-                logger.debug(" changed:  updated file")
+                # write to the file, soon
+                app['writers']['portal'].write(portal_str)
 
                 #    Send a JSON request to the drivers
-                logger.debug(" Notifying following clients: drivers %s ",driver_urls)
-
-                for a in actions:
-                    logger.info(" action: %s ", a)
-                    notify_msg = json.dumps({'status': portal_str,'action': a,'what_changed': what_changed,'time': timestamp})
+                logger.debug(" Notifying following clients: drivers %s ",list(drivers))
+
+                # everyone following the event stream gets it in one go
+                event_msg = app['events'].publish({'status': portal_str,'actions': actions,'what_changed': what_changed,'time': timestamp})
+
+                # batched: one notification per driver with all the actions,
+                # in order - the very same message as the event, serialized
+                # once.  Otherwise one per action, as the drivers always had.
+                if not actions:
+                    notify_msgs = []
+                elif g_config.get("batch_notifications", False):
+                    logger.info(" actions: %s ", actions)
+                    notify_msgs = [ event_msg ]
+                else:
+                    notify_msgs = []
+                    for a in actions:
+                        logger.info(" action: %s ", a)
+                        notify_msgs.append( json.dumps({'status': portal_str,'action': a,'what_changed': what_changed,'time': timestamp}) )
+
+                for notify_msg in notify_msgs:
 
                     # write notifications to a file
-                    if app['debug'] == "DEBUG":
-                        write_file(g_config["tracefile"], notify_msg + "\n", "a")
+                    if 'trace' in app['writers']:
+                        app['writers']['trace'].write(notify_msg + "\n")
 
-                    for u in driver_urls:
-                        n = Notification(app, u, notify_msg)
+                    for d in drivers.values():
+                        n = Notification(app, d, notify_msg)
                         n.enqueue()
 
             else:
                 logger.debug(" nothing changed ")
 
-            return status_obj
+            return what_changed
 
 # work routine that actually polls in a loop
 async def thulu_poller(app):
@@ -223,10 +347,11 @@ async def thulu_poller(app):
 
     g_config = app['config']
 
-    period = g_config["tecthulu_poll"]
+    poller = app['poller']
 
     logger = app['log']
-    logger.info(" started poller routine, running every %f seconds",period)
+    logger.info(" started poller routine, running every %f seconds, %f when busy, %f when idle",
+                poller.period, poller.fast, poller.idle)
 
     # reuse this object, no reason to create lots of them
     async with aiohttp.ClientSession(loop=loop) as session:
@@ -236,26 +361,30 @@ async def thulu_poller(app):
         while True:
             logger.debug(" hello says the poller! ")
 
+            # one request a cycle: getting the status is the health check too
             # todo: don't bother with user agent, other headers? ( skip_auto_headers )
+            poller.polls += 1
+            failures = poller.failures
             try:
- #               async with aiohttp.ClientSession(loop=loop) as session:
-                html = await fetch(session, g_config["tecthulu_url"])
-                logger.debug( "Poller: thulu is up, root received valid response")
-
                 # gets the status and decodes the json into an object
                 res = await portal_status(session, g_config['tecthulu_url'], app)
+                if poller.failures == failures:
+                    poller.failures = 0
 
             except aiohttp.ClientConnectionError as ex:
+                poller.failed()
                 logger.error( "Poller: could not connect to server, reason %s ",ex)
 
             except asyncio.TimeoutError as ex:
+                poller.failed()
                 logger.error( "Poller: timed out fetching from server, trying again ")
 
             except Exception as ex:
+                poller.failed()
                 traceback.print_exc()
                 logger.error( "Poller: unknown exception type %s",type(ex).__name__)
 
-            await asyncio.sleep(period) 
+            await asyncio.sleep(poller.next_interval())
 
 
 async def timer(app):
@@ -269,17 +398,25 @@ async def timer(app):
         await asyncio.sleep(period) 
 
 
-async def notifier_task(app):
-    logger.info(" notifier task started")
+# one of these per driver, each working through its own queue
+async def notifier_task(app, driver):
+    logger.info(" notifier task started for %s", driver.name)
 
-    queue = app['queue']
-    while True:
-        work = await queue.get()
-        try:
-            await work.notify()
-        except Exception as e:
-            #logger.error(" notification failed, %s",str(e))
-            pass
+    async with aiohttp.ClientSession(connector=driver.connector(), loop=loop) as session:
+        driver.session = session
+        while True:
+            work = await driver.queue.get()
+            try:
+                if await work.notify():
+                    driver.sent += 1
+                else:
+                    driver.failed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                driver.failed += 1
+                logger.debug(" notification to %s failed, %s",driver.name,str(e))
+            driver.latency.append(time.monotonic() - work.queued)
 
 
 #
@@ -290,11 +427,106 @@ async def notifier_task(app):
 
 # this needs UTF8 because names might have utf8
 async def statusJson(request):
-    portal = request.app['portal']
-    portal_str = ""
-    with portal.lock:
-        portal_str = str(portal)
-    return web.Response(text=portal_str , charset='utf-8')
+    # the current snapshot: no lock, it never changes under us, and it
+    # only serializes itself once
+    snap = request.app['portal'].snapshot
+    return snapshot_response(request, snap.tobytes(), snap.etag())
+
+async def statusLegacy(request):
+    snap = request.app['portal'].snapshot
+    return snapshot_response(request, snap.legacyBytes(), snap.legacyEtag())
+
+#
+# The event stream, see events.py. Clients resume with ?since=<seq>
+# (or, for SSE, the Last-Event-ID header the browser sends back).
+#
+
+# what a client that last saw 'since' has missed, subscribed to what comes next
+def events_since(app, since):
+    events = app['events']
+    q = events.subscribe()
+    missed = events.since(since)
+    if missed is None:
+        portal_str = str(app['portal'].snapshot)
+        sync = {'seq': events.seq, 'sync': True, 'status': portal_str, 'actions': [],
+                'what_changed': {}, 'time': str(datetime.datetime.now())}
+        missed = [ (events.seq, json.dumps(sync)) ]
+    return q, missed
+
+def requested_seq(request):
+    try:
+        return int(request.query.get('since', request.headers.get('Last-Event-ID', 0)))
+    except ValueError:
+        return 0
+
+async def next_event(q, keepalive):
+    try:
+        return await asyncio.wait_for(q.get(), keepalive)
+    except asyncio.TimeoutError:
+        return None
+
+async def events_ws(request):
+    app = request.app
+    keepalive = app['config'].get("event_keepalive", 15.0)
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+
+    # read, if only to see the client go away
+    async def reader():
+        async for msg in ws:
+            pass
+    read_task = asyncio.ensure_future(reader())
+
+    since = requested_seq(request)
+    q, missed = events_since(app, since)
+    logger.info(" event stream: websocket client from %d",since)
+    try:
+        for seq, data in missed:
+            await ws.send_str(data)
+        while not q.overflowed:
+            getter = asyncio.ensure_future(q.get())
+            done, pending = await asyncio.wait([getter, read_task], timeout=keepalive,
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                seq, data = getter.result()
+                await ws.send_str(data)
+                continue
+            getter.cancel()
+            if read_task.done():
+                break
+            await ws.ping()
+    except Exception as ex:
+        logger.debug(" event stream: websocket client gone, %s",str(ex))
+    finally:
+        app['events'].unsubscribe(q)
+        read_task.cancel()
+        await ws.close()
+    return ws
+
+async def events_sse(request):
+    app = request.app
+    keepalive = app['config'].get("event_keepalive", 15.0)
+    resp = web.StreamResponse(headers={'Content-Type': 'text/event-stream',
+                                       'Cache-Control': 'no-cache'})
+    await resp.prepare(request)
+
+    since = requested_seq(request)
+    q, missed = events_since(app, since)
+    logger.info(" event stream: SSE client from %d",since)
+    try:
+        for seq, data in missed:
+            await resp.write(("id: %d\ndata: %s\n\n" % (seq, data)).encode('utf-8'))
+        while not q.overflowed:
+            event = await next_event(q, keepalive)
+            if event is None:
+                await resp.write(b": keepalive\n\n")
+            else:
+                await resp.write(("id: %d\ndata: %s\n\n" % event).encode('utf-8'))
+    except Exception as ex:
+        logger.debug(" event stream: SSE client gone, %s",str(ex))
+    finally:
+        app['events'].unsubscribe(q)
+    return resp
 
 async def hello(request):
     return web.Response(text="Welcome to Magnus Flora Jarvis Server! Please replace me.")
@@ -302,6 +534,15 @@ async def hello(request):
 async def health(request):
     return web.Response(text="OK")
 
+# per-driver notification and event stream metrics, as JSON
+async def metrics(request):
+    m = {}
+    m['drivers'] = { name: d.stats() for name, d in request.app['drivers'].items() }
+    m['events'] = request.app['events'].stats()
+    m['poller'] = request.app['poller'].stats()
+    m['files'] = { name: w.stats() for name, w in request.app['writers'].items() }
+    return web.Response(text=json.dumps(m), content_type='application/json')
+
 
 # background tasks are covered near the bottom of this:
 # http://aiohttp.readthedocs.io/en/stable/web.html
@@ -310,7 +551,9 @@ async def health(request):
 async def start_background_tasks(app):
     app['timer_task'] = app.loop.create_task( timer(app))
     app['poller_task'] = app.loop.create_task( thulu_poller(app))
-    app['notifier_task'] = app.loop.create_task( notifier_task(app))
+    app['notifier_tasks'] = [ app.loop.create_task( notifier_task(app, d)) for d in app['drivers'].values() ]
+    for w in app['writers'].values():
+        w.start(app.loop)
 
 async def cleanup_background_tasks(app):
     app['log'].info(" cleaning up background tasks ")
@@ -318,8 +561,15 @@ async def cleanup_background_tasks(app):
     await app['timer_task']
     app['poller_task'].cancel()
     await app['poller_task']
-    app['notifier_task'].cancel()
-    await app['notifier_task']
+    for t in app['notifier_tasks']:
+        t.cancel()
+        try:
+            await t
+        except asyncio.CancelledError:
+            pass
+    # whatever changed last still goes to disk
+    for w in app['writers'].values():
+        await w.close(app.loop)
 
 def create_logger(args):
     # create a logging object and add it to the app object
@@ -349,12 +599,25 @@ async def init(app, args, loop):
     app.router.add_get('/health', health)
 
     app.router.add_get('/status/json', statusJson)
+    app.router.add_get('/status/legacy', statusLegacy)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_get('/events', events_sse)
+    app.router.add_get('/events/ws', events_ws)
 
     # create a portal object and stash it, many will need it
     app['portal'] = Portal(1, app['log'])
 
-    # worker queue for notifier tasks
-    app['queue'] = asyncio.Queue(loop = loop)
+    # a queue and a worker per driver, see Driver
+    app['drivers'] = create_drivers(app['config'])
+
+    # when to poll the Tecthulu, see Poller
+    app['poller'] = Poller(app['config'])
+
+    # portal changes, streamed to anyone who asks, see events.py
+    app['events'] = EventLog(app['config'].get("event_history", 500))
+
+    # the portal and trace files, see persist.py
+    app['writers'] = create_writers(app)
 
     # background tasks are covered near the bottom of this:
     # http://aiohttp.readthedocs.io/en/stable/web.html
@@ -46,6 +46,7 @@ import json
 import argparse
 
 import asyncio
+import functools
 import textwrap
 
 # things that led controllers want
@@ -63,6 +64,9 @@ from ledlib import patterns
 
 from ledlib.opcwrap import start_opc, ledwrite
 from ledlib import opcwrap
+from ledlib import heartbeat
+from ledlib import framecache
+import events
 
 from aiohttp import web
 
@@ -90,6 +94,15 @@ async def timer(app):
 # you manipulate it.
 #
 
+# a notification, posted to /portal or off the Jarvis event stream
+def handle_notification(app, req_obj):
+    log = app['log']
+    # straight onto the petal queues; the animation engine picks it up
+    # on the next frame and preempts anything less important
+    ledportal = app['ledportal']
+    issued = ledportal.notify(req_obj, log)
+    log.debug(" led actions: %s",[ str(a) for a in issued ])
+
 # this needs UTF8 because names might have utf8
 async def portal_notification(request):
 
@@ -100,8 +113,11 @@ async def portal_notification(request):
 
         req_obj = await request.json()
         log.debug(" received JSON %s",req_obj)
+
+        handle_notification(request.app, req_obj)
+
         r = web.Response(text="OK" , charset='utf-8')
-    except Exception as e:
+    except Exception as ex:
         log.warning(" exception while handing portal notification: %s ",str(ex))
         r = web.Response(text="FAIL")
 
@@ -111,6 +127,16 @@ async def portal_notification(request):
 async def hello(request):
     return web.Response(text="Welcome to Magnus Flora Led!")
 
+# frame clock, animation engine and power metrics, as JSON
+async def metrics(request):
+    m = {}
+    m['frameclock'] = heartbeat.get_clock().stats()
+    m['engine'] = request.app['ledportal'].engine.stats()
+    m['framecache'] = framecache.cache.stats()
+    if globaldata.power:
+        m['power'] = globaldata.power.stats()
+    return web.Response(text=json.dumps(m), content_type='application/json')
+
 async def health(request):
     return web.Response(text="OK")
 
@@ -121,11 +147,18 @@ async def health(request):
 
 async def start_background_tasks(app):
     app['timer_task'] = app.loop.create_task( timer(app) )
+    # follow the Jarvis event stream instead of waiting for posts
+    g_config = app['config']
+    if "led_url" in g_config.get("stream_drivers", []):
+        app['events_task'] = app.loop.create_task( events.follow(g_config["jarvis_events_url"],
+                        functools.partial(handle_notification, app), app['log']) )
 
 async def cleanup_background_tasks(app):
     app['log'].info(" cleaning up background tasks ")
     app['timer_task'].cancel()
     await app['timer_task']
+    if 'events_task' in app:
+        app['events_task'].cancel()
 
 def create_logger(args):
     # create a logging object and add it to the app object
@@ -151,6 +184,7 @@ async def init(app, args, loop):
 
     app.router.add_get('/', hello)
     app.router.add_get('/health', health)
+    app.router.add_get('/metrics', metrics)
 
     app.router.add_post('/portal', portal_notification)
 
@@ -286,7 +320,7 @@ led_init(args, g_config, log)
 
 print("starting MagnusFlora Led monitoring ",g_config["portalfile"]," on port ",g_config["led_port"])
 
-# start a simple thread to asynchronously push the pixel array to the LEDs
+# start the frame clock thread, which pushes the pixel array to the LEDs
 let_there_be_light = Thread(target=opcwrap.ledwriteloop)
 let_there_be_light.start()
 log.debug ("Let there be light!")
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+
+### VERY MUCH PYTHON 3 !!!
+
+#
+# The sound service's mixer: every sound goes through one output stream
+# that is opened at startup and stays open, so playing a sound starts no
+# process, and sounds can overlap.
+#
+# Clips are 16 bit PCM (numpy, frames x channels), see soundbank.py. A thread
+# renders a period at a time: it adds up every voice that is playing and
+# writes the result to the sink. Voices are on one of two layers. While
+# anything plays on the foreground layer, the background layer is ducked,
+# ramped over one period so it doesn't click.
+#
+# Times are in frames on the mixer's own clock, mixer.now(): a voice can be
+# started or stopped at an exact frame. Without one, it starts or stops at
+# the start of the next period.
+#
+# Background tracks go through a Playlist: one after another, crossfaded,
+# with no gap, for as long as the service runs.
+#
+# Sinks: the sound card (a long-lived aplay, or sox's play on a Mac, fed
+# raw PCM on stdin), a WAV file, or nothing at all, for tests.
+#
+# Usage:
+#   m = Mixer(default_sink(44100, 2))
+#   m.start()
+#   clip = bank.get("../audio/under_attack.wav")
+#   v = m.play(clip, done=lambda v: print("finished"))   # called on the mixer thread
+#   m.stop(v)
+#   m.close()
+#
+
+import platform
+import random
+import subprocess
+import threading
+import time
+import wave
+
+import numpy
+
+FOREGROUND = "foreground"
+BACKGROUND = "background"
+
+# a sound, decoded
+class Clip:
+
+    def __init__(self, name, pcm, rate):
+        self.name = name
+        self.pcm = pcm                  # int16, frames x channels
+        self.rate = rate
+        self.streamed = False           # read from disk as it plays
+
+    @property
+    def frames(self):
+        return len(self.pcm)
+
+    @property
+    def seconds(self):
+        return len(self.pcm) / self.rate
+
+# a clip playing, or about to
+class Voice:
+
+    def __init__(self, clip, layer, gain, start, done, fade_in=0, fade_out=0):
+        self.clip = clip
+        self.layer = layer
+        self.gain = gain
+        self.fade_in = fade_in          # frames at the start to fade in over
+        self.fade_out = fade_out        # frames at the end of the clip to fade out over
+        self.start = start              # mixer frame it starts at
+        self.end = None                 # mixer frame it stops at, if stopped early
+        self.pos = 0                    # frames of the clip played so far
+        self.done = done
+        self.finished = False           # true once it has played to its end
+
+    # the fades, for the next n frames; None if there are none there
+    def envelope(self, n):
+        fading_in = self.pos < self.fade_in
+        fading_out = self.fade_out > 0 and self.pos + n > self.clip.frames - self.fade_out
+        if not (fading_in or fading_out):
+            return None
+        p = numpy.arange(self.pos, self.pos + n, dtype=numpy.float32)
+        env = numpy.ones(n, dtype=numpy.float32)
+        if fading_in:
+            numpy.minimum(env, (p + 1) / self.fade_in, out=env)
+        if fading_out:
+            numpy.minimum(env, (self.clip.frames - p) / self.fade_out, out=env)
+        return env[:,None]
+
+class Mixer:
+
+    def __init__(self, sink, rate=44100, channels=2, period=1024, duck=0.3, log=None):
+        self.sink = sink
+        self.rate = rate
+        self.channels = channels
+        self.period = period            # frames rendered at a time
+        self.duck = duck                # background gain under a foreground sound
+        self.log = log
+        self.lock = threading.Lock()
+        self.voices = []
+        self.frame = 0                  # frames rendered so far: the clock
+        self.background_gain = 1.0
+        self.thread = None
+        self.running = False
+        self.underruns = 0
+
+    # the frame the next period starts at
+    def now(self):
+        with self.lock:
+            return self.frame
+
+    def play(self, clip, layer=FOREGROUND, gain=1.0, at=None, done=None, fade_in=0, fade_out=0):
+        with self.lock:
+            v = Voice(clip, layer, gain, self.frame if at is None else max(at, self.frame), done, fade_in, fade_out)
+            self.voices.append(v)
+        return v
+
+    def set_fade_out(self, voice, frames):
+        with self.lock:
+            voice.fade_out = frames
+
+    def stop(self, voice, at=None):
+        with self.lock:
+            voice.end = self.frame if at is None else max(at, self.frame)
+
+    def playing(self, layer=None):
+        with self.lock:
+            return [ v for v in self.voices if layer is None or v.layer == layer ]
+
+    # mix the next frames, and move the clock on. The thread calls this;
+    # tests can too, without starting the thread.
+    def render(self, frames):
+        out = numpy.zeros((frames, self.channels), dtype=numpy.float32)
+        ended = []
+        with self.lock:
+            start = self.frame
+            stop = start + frames
+
+            # the background's gain, ramped from where it was to where it goes
+            target = self.duck if any(v.layer == FOREGROUND and v.start < stop for v in self.voices) else 1.0
+            ramp = numpy.linspace(self.background_gain, target, frames, endpoint=False, dtype=numpy.float32)[:,None]
+            self.background_gain = target
+
+            for v in self.voices:
+                first = max(v.start, start)
+                last = stop if v.end is None else min(stop, v.end)
+                n = min(last - first, v.clip.frames - v.pos)
+                if n > 0:
+                    o = first - start
+                    pcm = v.clip.pcm[v.pos:v.pos + n]
+                    if v.layer == BACKGROUND:
+                        gain = ramp[o:o + n] * v.gain
+                    else:
+                        gain = numpy.float32(v.gain)
+                    env = v.envelope(n)
+                    if env is not None:
+                        gain = gain * env
+                    out[o:o + n] += pcm * gain
+                    v.pos += n
+                if v.pos >= v.clip.frames or (v.end is not None and v.end <= stop):
+                    v.finished = v.pos >= v.clip.frames
+                    ended.append(v)
+
+            for v in ended:
+                self.voices.remove(v)
+            self.frame = stop
+
+        # outside the lock: they may well play something else
+        for v in ended:
+            if v.done is not None:
+                v.done(v)
+
+        numpy.clip(out, -32768, 32767, out=out)
+        return out.astype('<i2')
+
+    def run(self):
+        # the sound card's stream sets the pace; a file or nothing, the clock
+        began = time.monotonic()
+        while self.running:
+            pcm = self.render(self.period)
+            try:
+                self.sink.write(pcm.tobytes())
+            except Exception as ex:
+                if self.log:
+                    self.log.error(" mixer: sink failed: %s", str(ex))
+                self.running = False
+                break
+            if not self.sink.paced:
+                ahead = began + self.frame / self.rate - time.monotonic()
+                if ahead > 0:
+                    time.sleep(ahead)
+                else:
+                    self.underruns += 1
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="mixer", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.sink.close()
+
+    def stats(self):
+        with self.lock:
+            return { 'seconds': round(self.frame / self.rate, 3),
+                     'voices': [ (v.layer, v.clip.name) for v in self.voices ],
+                     'background_gain': self.background_gain,
+                     'underruns': self.underruns }
+
+#
+# Background tracks without a break: when a track starts, the next one is
+# put on the mixer's clock to start crossfade frames before this one ends,
+# fading in while this one fades out. It's all on the background layer, so
+# it ducks under actions rather than stopping for them. The sound bank's
+# readahead reads the start of the next track as soon as it is scheduled.
+#
+class Playlist:
+
+    def __init__(self, mixer, clips, crossfade=2.0, gain=1.0):
+        self.mixer = mixer
+        self.clips = list(clips)
+        self.crossfade = int(crossfade * mixer.rate)
+        self.gain = gain
+        self.current = None
+        self.next = None
+        self.running = False
+        self.tracks = 0
+
+    # any track but the last one, if there is a choice
+    def pick(self, last):
+        choices = [ c for c in self.clips if c is not last ] or self.clips
+        return random.choice(choices)
+
+    def start(self):
+        if self.running or not self.clips:
+            return
+        self.running = True
+        self.current = self.mixer.play(self.pick(None), BACKGROUND, self.gain, done=self.ended)
+        self.tracks += 1
+        self.next = self.follow(self.current)
+
+    def stop(self):
+        self.running = False
+        for v in (self.current, self.next):
+            if v is not None:
+                self.mixer.stop(v)
+        self.current = self.next = None
+
+    # schedule the track after v
+    def follow(self, v):
+        clip = self.pick(v.clip)
+        xf = min(self.crossfade, v.clip.frames // 2, clip.frames // 2)
+        self.mixer.set_fade_out(v, xf)
+        return self.mixer.play(clip, BACKGROUND, self.gain, at=v.start + v.clip.frames - xf,
+                               done=self.ended, fade_in=xf)
+
+    # on the mixer thread: a track is over, and the next one already playing
+    def ended(self, v):
+        if not self.running or v is not self.current:
+            return
+        self.current = self.next
+        self.tracks += 1
+        self.next = self.follow(self.current)
+
+    def playing(self):
+        return self.current.clip.name if self.current is not None else None
+
+#
+# Sinks: write(bytes of interleaved 16 bit frames), close(). paced is true
+# if write() blocks until the sound is played, more or less.
+#
+
+# a player process, started once, that reads raw PCM from its stdin
+class PipeSink:
+
+    paced = True
+
+    def __init__(self, command):
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, data):
+        self.proc.stdin.write(data)
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.proc.wait()
+
+class FileSink:
+
+    paced = False
+
+    def __init__(self, filename, rate, channels):
+        self.wf = wave.open(filename, 'wb')
+        self.wf.setnchannels(channels)
+        self.wf.setsampwidth(2)
+        self.wf.setframerate(rate)
+
+    def write(self, data):
+        self.wf.writeframes(data)
+
+    def close(self):
+        self.wf.close()
+
+class NullSink:
+
+    paced = False
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        pass
+
+# the sound card
+def default_sink(rate, channels):
+    if platform.system() == 'Darwin':
+        command = [ "play", "-q", "-t", "raw", "-r", str(rate), "-e", "signed", "-b", "16",
+                    "-c", str(channels), "-" ]
+    elif platform.system() == 'Linux':
+        # a 100ms buffer: short enough that a sound starts when it's asked to
+        command = [ "aplay", "-q", "-t", "raw", "-f", "S16_LE", "-r", str(rate),
+                    "-c", str(channels), "-B", "100000" ]
+    else:
+        raise RuntimeError("unknown operating system, can't play sounds")
+    return PipeSink(command)
+
+# "device" (the default), "null", or the name of a WAV file to write
+def create_sink(name, rate, channels):
+    if name == "device":
+        return default_sink(rate, channels)
+    if name == "null":
+        return NullSink()
+    return FileSink(name, rate, channels)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+### VERY MUCH PYTHON 3 !!!
+
+#
+# Writing Jarvis's files without holding up the event loop.
+#
+# Writing the portal file on the event loop, on every change, can take long
+# enough on a Pi's SD card to delay the next poll. A FileWriter takes the
+# text and returns at once. Its own task waits a moment for more (an attack
+# is a burst of changes), then writes in a worker thread:
+#   - a replaced file (the portal file) gets only the newest text, through
+#     a temp file and a rename, so nobody ever sees half a file
+#   - an appended file (the trace) gets everything, in order, in one write
+# fsync: 0 after every write, N at most once every N seconds, negative never.
+#
+# Usage:
+#   w = FileWriter("portal.json", log)
+#   w.start(loop)
+#   w.write(portal_str)
+#   await w.close(loop)         # writes whatever is still pending
+#
+
+import asyncio
+import os
+import threading
+import time
+
+class FileWriter:
+
+    def __init__(self, filename, log, append=False, delay=0.2, fsync=0):
+        self.filename = filename
+        self.log = log
+        self.append = append
+        self.delay = delay              # seconds to wait for more before writing
+        self.fsync = fsync
+        self.pending = []
+        self.wakeup = None
+        self.task = None
+        self.lock = threading.Lock()    # one write to the file at a time
+        self.last_fsync = 0.0
+        self.submitted = 0
+        self.writes = 0
+        self.errors = 0
+        self.write_time = 0.0
+
+    def start(self, loop):
+        self.wakeup = asyncio.Event()
+        self.task = loop.create_task(self.run(loop))
+
+    # never blocks: the text is written a little later, by the task
+    def write(self, text):
+        self.submitted += 1
+        if self.append:
+            self.pending.append(text)
+        else:
+            self.pending = [ text ]
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def run(self, loop):
+        while True:
+            await self.wakeup.wait()
+            # let a burst of changes pile up into one write
+            await asyncio.sleep(self.delay)
+            await self.flush(loop)
+
+    async def flush(self, loop):
+        self.wakeup.clear()
+        if not self.pending:
+            return
+        text = ''.join(self.pending)
+        self.pending = []
+        try:
+            await loop.run_in_executor(None, self.write_now, text)
+        except Exception as ex:
+            self.errors += 1
+            self.log.warning(" could not write %s: %s",self.filename,str(ex))
+
+    async def close(self, loop):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush(loop)
+
+    # in a worker thread
+    def write_now(self, text):
+        start = time.monotonic()
+        with self.lock:
+            if self.append:
+                with open(self.filename, "a") as f:
+                    f.write(text)
+                    self.sync(f)
+            else:
+                tmp = self.filename + ".tmp"
+                with open(tmp, "w") as f:
+                    f.write(text)
+                    self.sync(f)
+                os.replace(tmp, self.filename)
+            self.writes += 1
+            self.write_time += time.monotonic() - start
+
+    def sync(self, f):
+        if self.fsync < 0:
+            return
+        now = time.monotonic()
+        if now - self.last_fsync < self.fsync:
+            return
+        f.flush()
+        os.fsync(f.fileno())
+        self.last_fsync = now
+
+    def stats(self):
+        return { 'file': self.filename, 'submitted': self.submitted, 'writes': self.writes,
+                 'pending': len(self.pending), 'errors': self.errors,
+                 'write_ms': round(self.write_time * 1000.0 / max(self.writes, 1), 2) }
@@ -41,6 +41,12 @@ import copy
 
 import json
 
+import hashlib
+
+import collections
+
+import types
+
 
 
 # todo: since a mod has an owner, should make it a class as well, for parallelism sake
@@ -53,6 +59,9 @@ class Resonator:
     # ordering is important. Sorry
     valid_positions = [  "N", "NE", "E", "SE", "S", "SW","W", "NW" ]
 
+    # there are a lot of these, and they are made on every change
+    __slots__ = ( 'portal', 'position', 'log', 'level', 'health', 'distance', 'owner' )
+
     def __init__(self, position, portal, log, values=None ):
         # print ("Resonator create: position ",position)
         self.portal = portal
@@ -125,6 +134,17 @@ class Resonator:
     def hasinterrupt(self):
         return False
 
+    # true if values (as in a status JSON) say exactly what this resonator
+    # already says, so there is no need to make a new one to compare
+    def sameValues(self, values):
+        try:
+            return self.level == int(values.get("level",0)) and \
+                self.health == int(values.get("health",0)) and \
+                self.distance == int(values.get("distance",0)) and \
+                self.owner == str(values.get("owner", ""))
+        except (TypeError, ValueError):
+            return False
+
     # sometimes it's nice to have the interesting values as a dict
     def getValues(self):
         v = {}
@@ -225,14 +245,236 @@ class Resonator:
 
     def toLegacyStr(self):
         # print (" grabbing reso string: level ",self.level)
-        return '{{"level": {0}, "health": {1}, "position": "{2}"}}'.format(self.level, self.health, self.position)
+        return resonator_legacy_str(self)
 
     # without the position, sometimes that is implied 
     def toBetterStr(self):
-        if self.level == 0:
-            return'"{0}": {{"level": {1} }}'.format(self.position, self.level)
-        else:
-            return '"{0}": {{"level": {1}, "health": {2}, "distance": {3} }}'.format(self.position, self.level, self.health, self.distance)
+        return resonator_str(self)
+
+#
+# A portal's resonators: at most one per position, so a fixed 8-slot
+# layout in valid_positions order rather than a dict. Reads and writes
+# like a dict keyed by position (get, items, pop, [pos] = r, ...).
+# Positions come out in valid_positions order.
+#
+class ResonatorMap:
+
+    __slots__ = ( 'slots', )
+
+    index = { pos: i for i, pos in enumerate(Resonator.valid_positions) }
+
+    def __init__(self, other=None):
+        if isinstance(other, ResonatorMap):
+            self.slots = list(other.slots)
+            return
+        self.slots = [ None ] * len(Resonator.valid_positions)
+        if other is not None:
+            for pos, r in other.items():
+                self[pos] = r
+
+    def __getitem__(self, pos):
+        r = self.slots[self.index[pos]] if pos in self.index else None
+        if r is None:
+            raise KeyError(pos)
+        return r
+
+    def __setitem__(self, pos, r):
+        # a position outside valid_positions is a KeyError
+        self.slots[self.index[pos]] = r
+
+    def __delitem__(self, pos):
+        self[pos]
+        self.slots[self.index[pos]] = None
+
+    def __contains__(self, pos):
+        return pos in self.index and self.slots[self.index[pos]] is not None
+
+    def __len__(self):
+        return sum(1 for r in self.slots if r is not None)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, pos, default=None):
+        r = self.slots[self.index[pos]] if pos in self.index else None
+        return default if r is None else r
+
+    def pop(self, pos, *default):
+        if pos not in self:
+            if default:
+                return default[0]
+            raise KeyError(pos)
+        r = self.slots[self.index[pos]]
+        self.slots[self.index[pos]] = None
+        return r
+
+    def keys(self):
+        return [ pos for pos, r in zip(Resonator.valid_positions, self.slots) if r is not None ]
+
+    def values(self):
+        return [ r for r in self.slots if r is not None ]
+
+    def items(self):
+        return [ (pos, r) for pos, r in zip(Resonator.valid_positions, self.slots) if r is not None ]
+
+    def __repr__(self):
+        return '{' + ', '.join( str(r) for r in self.values() ) + '}'
+
+# works on a Resonator or a ResonatorSnapshot
+def resonator_legacy_str(r):
+    return '{{"level": {0}, "health": {1}, "position": "{2}"}}'.format(r.level, r.health, r.position)
+
+# works on a Resonator or a ResonatorSnapshot
+def resonator_str(r):
+    if r.level == 0:
+        return'"{0}": {{"level": {1} }}'.format(r.position, r.level)
+    else:
+        return '"{0}": {{"level": {1}, "health": {2}, "distance": {3} }}'.format(r.position, r.level, r.health, r.distance)
+
+# the game state of a resonator, frozen
+ResonatorSnapshot = collections.namedtuple('ResonatorSnapshot', [ 'position', 'level', 'health', 'distance', 'owner' ])
+
+# works on a Portal or a PortalSnapshot
+def portal_str(p):
+
+    # shortcut - grey
+    if p.level == 0:
+        return '{{"faction": 0, "health": 0, "level": 0, "title":"{0}","resonators": {{}}, "mods": [] }}'.format(p.title)
+
+    #longcut
+    howmany = 0
+    resos = []
+    for k, v in p.resonators.items():
+        # skip if empty, saving space & time
+        if v.level == 0:
+            continue
+        howmany += 1
+        resos.append(resonator_str(v))
+        resos.append(",")
+    if (howmany > 0):
+        resos.pop()
+    reso_string = ''.join(resos)
+
+    mods = []
+    howmany = 0
+    for v in p.mods:
+        mods.append('"')
+        mods.append(v)
+        mods.append('"')
+        mods.append(',')
+        howmany += 1
+    if howmany > 0:
+        mods.pop()
+    mod_string = ''.join(mods)
+
+    return '{{"faction": {0}, "health": {1}, "level": {2}, "title": "{3}", "resonators": {{{4}}}, "mods": [{5}] }}'.format( 
+        p.faction, p.health, p.level, p.title, reso_string, mod_string )
+
+# This is the "current form" that is mussing a lot of information
+# works on a Portal or a PortalSnapshot
+def portal_legacy_str(p):
+    resos = []
+    num_entries = 0
+    for k, v in p.resonators.items():
+        # skip if empty, saving space & time
+        # print(" r position ",k," value ",str(v))
+        if v.level == 0:
+            continue
+        num_entries += 1
+        resos.append(resonator_legacy_str(v))
+        resos.append(",")
+    # have to take off the last comma if more than one item
+    if num_entries > 0:
+        resos.pop()
+    reso_string = ''.join(resos)
+    return '{{"controllingFaction": {0}, "health": {1}, "level": {2}, "title": "{3}", "resonators": [{4}]}}'.format( 
+        p.faction, p.health, p.level, p.title, reso_string )
+
+#
+# An immutable copy of a Portal's game state. The Portal makes a new one
+# every time it changes and swaps it in as portal.snapshot, one reference
+# assignment, so readers just take
+#       snap = portal.snapshot
+# and use it for as long as they like, without the lock, and without it
+# changing under them.
+#
+# The serialized forms - str(snap), tobytes(), statusLegacy(), and an
+# ETag for them - are worked out the first time someone asks, and then
+# kept for as long as this state lasts. Two readers may both work one out
+# the first time; they get the same answer.
+#
+class PortalSnapshot:
+
+    __slots__ = ( 'version', 'faction', 'health', 'level', 'title', 'owner', 'owner_id',
+                  'resonators', 'mods', 'last_mod_time',
+                  '_str', '_bytes', '_legacy', '_legacy_bytes', '_etag', '_legacy_etag' )
+
+    def __init__(self, portal):
+        init = object.__setattr__
+        init(self, 'version', portal.version)
+        init(self, 'faction', portal.faction)
+        init(self, 'health', portal.health)
+        init(self, 'level', portal.level)
+        init(self, 'title', portal.title)
+        init(self, 'owner', portal.owner)
+        init(self, 'owner_id', portal.owner_id)
+        init(self, 'resonators', types.MappingProxyType( { pos: ResonatorSnapshot(r.position, r.level, r.health, r.distance, r.owner)
+                                                          for pos, r in portal.resonators.items() } ))
+        init(self, 'mods', tuple(portal.mods))
+        init(self, 'last_mod_time', portal.last_mod_time)
+        for cached in ( '_str', '_bytes', '_legacy', '_legacy_bytes', '_etag', '_legacy_etag' ):
+            init(self, cached, None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PortalSnapshot is read-only")
+
+    def getLevel(self):
+        return self.level
+
+    def getHealth(self):
+        return self.health
+
+    def __str__(self):
+        if self._str is None:
+            object.__setattr__(self, '_str', portal_str(self))
+        return self._str
+
+    # the status JSON, utf-8, as served on /status/json
+    def tobytes(self):
+        if self._bytes is None:
+            object.__setattr__(self, '_bytes', str(self).encode('utf-8'))
+        return self._bytes
+
+    def statusLegacy(self):
+        if self._legacy is None:
+            object.__setattr__(self, '_legacy', portal_legacy_str(self))
+        return self._legacy
+
+    def legacyBytes(self):
+        if self._legacy_bytes is None:
+            object.__setattr__(self, '_legacy_bytes', self.statusLegacy().encode('utf-8'))
+        return self._legacy_bytes
+
+    # strong ETags for tobytes() and legacyBytes(): the same state gives the
+    # same tag, even across restarts
+    def etag(self):
+        if self._etag is None:
+            object.__setattr__(self, '_etag', '"' + hashlib.sha1(self.tobytes()).hexdigest()[:20] + '"')
+        return self._etag
+
+    def legacyEtag(self):
+        if self._legacy_etag is None:
+            object.__setattr__(self, '_legacy_etag', '"' + hashlib.sha1(self.legacyBytes()).hexdigest()[:20] + '"')
+        return self._legacy_etag
+
+# For the aiohttp services: serve one of a snapshot's cached forms, or just
+# a 304 if the client already has it. aiohttp is imported here rather than
+# at the top because led/ shares this file, and doesn't use it.
+def snapshot_response(request, body, etag):
+    from aiohttp import web
+    if etag in [ t.strip() for t in request.headers.get('If-None-Match', '').split(',') ]:
+        return web.Response(status=304, headers={'ETag': etag})
+    return web.Response(body=body, content_type='text/plain', charset='utf-8', headers={'ETag': etag})
 
 # WARNING! This class has multithreaded access.
 # Before you access the data structure, grab the lock and release afterward
@@ -243,6 +485,12 @@ class Portal:
     valid_mods = ["FA","HS-C","HS-R","HS-VR","LA-R","LA-VR","SBUL","MH-C","MH-R","MH-VR","PS-C","PS-R","PS-VR","AXA","T"]
     reso_level_XM = [0.0, 1000.0, 1500.0, 2000.0, 2500.0, 3000.0, 4000.0, 5000.0, 6000.0 ]
 
+    # one of these lives as long as the process does; the LedPortal
+    # subclass adds its own attributes on top
+    __slots__ = ( 'faction', 'health', 'level', 'id_', 'title', 'owner', 'owner_id',
+                  'resonators', 'links', 'mods', 'lock', 'create_time', 'last_mod_time',
+                  'log', 'version', 'snapshot', 'raw_digest', 'raw_unchanged' )
+
     def __init__(self, id_, log):
         self.faction = 0
         self.health = 0
@@ -251,30 +499,43 @@ class Portal:
         self.title = "default portal"
         self.owner = ""
         self.owner_id = 0
-        self.resonators = { }
+        self.resonators = ResonatorMap()
         self.links = []
         self.mods = []
         self.lock = threading.Lock()  
         self.create_time = time.time()
         self.last_mod_time = time.time()
         self.log = log
+        # readers that don't want the lock use this, see PortalSnapshot
+        self.version = 0
+        self.snapshot = PortalSnapshot(self)
+        # digest of the last raw payload setStatusRaw applied, see there
+        self.raw_digest = None
+        self.raw_unchanged = 0
         # print("Created a new portal object")  
 
     # returns a new object of the Portal type
+    # It's a scratch copy for setStatusJson to change, made on every status:
+    # so not through __init__, which would make a snapshot and a lock for it
     def dup(self):
-        n = Portal(self.id_, self.log)
+        n = object.__new__(Portal)
+        n.id_ = self.id_
+        n.log = self.log
+        n.version = self.version
+        n.snapshot = None
+        n.raw_digest = None
+        n.raw_unchanged = 0
         n.faction = self.faction
         n.health = self.health
         n.level = self.level
         n.title = self.title
         n.owner = self.owner
         n.owner_id = self.owner_id
-        if self.resonators:
-            n.resonators = self.resonators
-        if self.links:
-            n.links = self.links
-        if self.mods:
-            n.mods = self.mods
+        # copies, not the same dict and lists: the caller changes them
+        # while this object may still be read
+        n.resonators = ResonatorMap(self.resonators)
+        n.links = list(self.links)
+        n.mods = list(self.mods)
         n.lock = None
         n.create_time = self.create_time
         n.last_mod_time = self.last_mod_time
@@ -296,6 +557,9 @@ class Portal:
         self.mods = n.mods
         self.last_mod_time = n.last_mod_time
         self.log = n.log
+        # publish: one reference swap, readers see the old or the new
+        self.version += 1
+        self.snapshot = PortalSnapshot(self)
 
     # Health is calculated from resonators states so it is always correct
     def getLevel(self):
@@ -336,73 +600,22 @@ class Portal:
                 return False
         return True
 
-    # This function takes a Json string from the file
-    # Returns an object for the next line to read
+    # This function takes a Json string from a simulation file, one line
+    # The line is a delta (see mergeStatus), applied the same way setStatusJson does
+    # Returns the delay before the next line is read, None if the line is no good
     def setStatusFile( self, jsonStr, lineNumber ):
-        log.verbose("Portal set status: line %d using %s ",lineNumber,jsonStr)
+        self.log.debug("Portal set status: line %d using %s ",lineNumber,jsonStr)
 
         try:
             statusObj = json.loads(jsonStr)
         except Exception as ex:
-            template = "Exception in Portal parsing the json string {0} occurred. Arguments:\n{1!r}"
-            message = template.format(type(ex).__name__, ex.args)
-            print( message )
+            self.log.warning(" !!! line %d is not JSON, ignored: %s",lineNumber,str(ex))
+            return None
+        if type(statusObj) is not dict:
+            self.log.warning(" !!! line %d is not a JSON object, ignored",lineNumber)
             return None
 
-        # print(" parsed JSON, taking lock. Object is: ",statusObj)
-        with self.lock:
-            portal = self.dup()
-
-        now = time.time()
-
-        if "title" in statusObj:
-            t = str(statusObj.get("title"))
-            if t != portal.title :
-                portal.title = t
-                portal.last_mod_time = now
-
-        if "faction" in statusObj:
-            t = int(statusObj.get("faction"))
-            if portal.faction != t :
-                portal.faction = t
-                portal.last_mod_time = now
-
-
-        if "owner" in statusObj:
-            t = str(statusObj.get("owner"))
-            if t != portal.owner :
-                portal.owner = t
-                portal.last_mod_time = now
-
-        if "mods" in statusObj:
-            t_mods = statusObj.get("mods")
-            t_mods.sort()
-            if portal.mods != t_mods :
-                portal.mods = t_mods
-                portal.last_mod_time = now
-
-        if "resonators" in statusObj:
-            resonators = statusObj.get("resonators")
-            for pos, values in resonators.items():
-                r = Resonator(pos, None, None, values  )
-                portal.resonators[pos] = r
-
-            # if we changed the resonators, update the health and level
-            portal.level = portal.getLevel()
-            portal.health = portal.getHealth()
-
-        # validate the new object through the validator
-        if portal.check() == False:
-            print (" !!! Bad format after applying delta, line ",lineNumber," ignored ")
-
-            print (" delta which will not be applied: ", str(portal) )
-
-        else:
-            # copy the parts that should be copied ( ie, not the lock or create time )
-            with self.lock:
-                self.set(portal)
-
-#        log.verbose ("+++++ object after changes: %s",portal)
+        self.setStatusJson(self.mergeStatus(statusObj), self.log)
 
         # return value is the amount of delay to add
         delay = 0.0
@@ -410,6 +623,50 @@ class Portal:
             delay = float(statusObj.get("delay"))
         return delay
 
+    # A simulation file line only says what changes: the resonators it names,
+    # the others stay as they are. setStatusJson wants the whole status, so
+    # merge the line onto the current state. The simulator's game rules go
+    # here too, not in setStatusJson, which takes the Tecthulu's word for it:
+    # a resonator with no level or no health is at level 0, and a portal that
+    # goes neutral loses its resonators and mods. A line that goes neutral
+    # and still names resonators or mods fails check(), as it always did.
+    def mergeStatus( self, statusObj ):
+        status = dict(statusObj)
+        snap = self.snapshot
+
+        resonators = { pos: r._asdict() for pos, r in snap.resonators.items() }
+        if "faction" in statusObj and int(statusObj.get("faction")) == 0:
+            resonators = {}
+            status.setdefault("mods", [])
+
+        if "resonators" in statusObj:
+            for pos, values in statusObj.get("resonators").items():
+                values = dict(values)
+                if int(values.get("level",0)) == 0 or int(values.get("health",0)) == 0:
+                    values = {"level": 0, "health": 0, "distance": 0, "owner": ""}
+                resonators[pos] = values
+        status["resonators"] = resonators
+
+        return status
+
+    # The fast path for pollers: takes the raw bytes (or string) of a status,
+    # and if they are exactly what was applied last time, nothing can have
+    # changed - so don't parse, dup, or diff anything.
+    # Otherwise the same as setStatusJson( json.loads(raw) ).
+    # Raises ValueError if raw is not JSON.
+    def setStatusRaw( self, raw, log ):
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+        digest = hashlib.sha1(raw).digest()
+        if digest == self.raw_digest:
+            self.raw_unchanged += 1
+            return None, None
+
+        statusObj = json.loads(raw.decode('utf-8'))
+        actions, what_changed = self.setStatusJson(statusObj, log)
+        self.raw_digest = digest
+        return actions, what_changed
+
     # This function takes a Json string
     # changes the object
     # Returns a dict showing what changed
@@ -462,6 +719,19 @@ class Portal:
 
                 log.debug(" what changed: owner %s",portal.owner)
 
+        # mods are state only, nothing to act on. A list that isn't all known
+        # mods is left alone rather than failing the whole status
+        if "mods" in statusObj:
+            new_mods = statusObj.get("mods")
+            if type(new_mods) is not list or not all(m in self.valid_mods for m in new_mods):
+                log.warning (" !!! Bad mods %s, ignored ", str(new_mods))
+            elif sorted(new_mods) != portal.mods:
+                is_changed = True
+                portal.mods = sorted(new_mods)
+                what_changed["mods"] = portal.mods
+
+                log.debug(" what changed: mods %s", str(portal.mods))
+
 #        log.debug("Portal set status: mods  " )
 
 #        if "mods" in statusObj:
@@ -505,8 +775,16 @@ class Portal:
 
             for pos, values in resonators.items():
 
+                if pos not in self.valid_positions:
+                    log.warning (" !!! Bad resonator position %s, ignored ", pos)
+                    return None, None
+
+                old_r = portal.resonators.get(pos,None)
+                if old_r is not None and old_r.sameValues(values):
+                    continue
+
                 r = Resonator(pos, None, log, values )
-                acts, diffs = Resonator.difference( portal.resonators.get(pos,None), r, log)
+                acts, diffs = Resonator.difference( old_r, r, log)
 
                 # log.debug(" what changed: reso %s value %s",pos,diffs)
                 
@@ -543,6 +821,8 @@ class Portal:
                 # copy the parts that should be copied ( ie, not the lock or create time )
                 with self.lock:
                     self.set(portal)
+                # changed some other way than the last raw payload
+                self.raw_digest = None
 
         # log.debug("+++++ object after changes: %s",str(self))
 
@@ -588,58 +868,11 @@ class Portal:
 
     # This is the "current form" that is mussing a lot of information
     def statusLegacy(self):
-        resos = []
-        num_entries = 0
-        for k, v in self.resonators.items():
-            # skip if empty, saving space & time
-            # print(" r position ",k," value ",str(v))
-            if v.level == 0:
-                continue
-            num_entries += 1
-            resos.append(v.toLegacyStr())
-            resos.append(",")
-        # have to take off the last comma if more than one item
-        if num_entries > 0:
-            resos.pop()
-        reso_string = ''.join(resos)
-        return '{{"controllingFaction": {0}, "health": {1}, "level": {2}, "title": "{3}", "resonators": [{4}]}}'.format( 
-            self.faction, self.health, self.level, self.title, reso_string )
+        return portal_legacy_str(self)
 
     # not legacy! The cool kid way with resonators as a dict
     def __str__(self):
-
-        # shortcut - grey
-        if self.level == 0:
-            return '{{"faction": 0, "health": 0, "level": 0, "title":"{0}","resonators": {{}}, "mods": [] }}'.format(self.title)
-
-        #longcut
-        howmany = 0
-        resos = []
-        for k, v in self.resonators.items():
-            # skip if empty, saving space & time
-            if v.level == 0:
-                continue
-            howmany += 1
-            resos.append(v.toBetterStr())
-            resos.append(",")
-        if (howmany > 0):
-            resos.pop()
-        reso_string = ''.join(resos)
-
-        mods = []
-        howmany = 0
-        for v in self.mods:
-            mods.append('"')
-            mods.append(v)
-            mods.append('"')
-            mods.append(',')
-            howmany += 1
-        if howmany > 0:
-            mods.pop()
-        mod_string = ''.join(mods)
-
-        return '{{"faction": {0}, "health": {1}, "level": {2}, "title": "{3}", "resonators": {{{4}}}, "mods": [{5}] }}'.format( 
-            self.faction, self.health, self.level, self.title, reso_string, mod_string )
+        return portal_str(self)
 
     # this method makes sure the status is valid and reasonable ( no values greater than game state )
     def check(self):
@@ -667,12 +900,9 @@ class Portal:
         if len(self.title) > 300:
             print("Portal title seems too long")
             return False
-        if type(self.resonators) is not dict:
+        if type(self.resonators) is not ResonatorMap:
             print("Portal resonator type wrong, is ",type(self.resonators))
             return False
-        if len(self.resonators) > 8:
-            print("Portal has incorrect number of resonators ",len(self.resontaors))
-            return False
         for k,v in self.resonators.items():
             if k not in self.valid_positions:
                 print("resonator has invalid position ",k)
@@ -680,6 +910,9 @@ class Portal:
             if v.check() == False:
                 print(" resonator ",v," is not valid ")
                 return False
+        if (self.faction == 0) and (len(self.resonators) > 0):
+            print(" portal must have faction if it has resonators ")
+            return False
         if type(self.mods) is not list:
             print("Mods wrong type, is ",type(self.mods))
             return False
@@ -693,5 +926,8 @@ class Portal:
             if m not in self.valid_mods:
                 print ("invalid mod ",m)
                 return False
+        if (self.faction == 0) and (len(self.mods) > 0):
+            print(" portal must have faction if it has mods ")
+            return False
         return True
 
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+### VERY MUCH PYTHON 3 !!!
+
+#
+# Micro-benchmark for the Jarvis poll path on a steady-state portal: the
+# Tecthulu keeps answering with the same status, and nothing changes.
+#
+# Compares the full path (json.loads, then Portal.setStatusJson: dup, 8 new
+# Resonators, the diff, check) with Portal.setStatusRaw, which skips all of
+# that when the raw bytes are the same as last time.
+#
+# rest/portal.py is the one portal model (led/ledlib, flask and sim link
+# to it), so this covers all of them.
+#
+# Standalone, no Tecthulu needed.
+# Sample usage:
+# $ python portalbench.py
+# $ python portalbench.py --polls 20000
+#
+
+import argparse
+import json
+import logging
+import sys
+import time
+
+from portal import Portal
+
+steady_status = {
+    "title": "Magnus Flora",
+    "faction": 1,
+    "owner": "ingress_agent",
+    "mods": [ "FA", "HS-R" ],
+    "resonators": {
+        "N":  { "level": 8, "health": 100, "distance": 30, "owner": "ingress_agent" },
+        "NE": { "level": 7, "health": 95,  "distance": 28, "owner": "ingress_agent" },
+        "E":  { "level": 6, "health": 90,  "distance": 35, "owner": "ingress_agent" },
+        "SE": { "level": 8, "health": 85,  "distance": 31, "owner": "ingress_agent" },
+        "S":  { "level": 5, "health": 100, "distance": 22, "owner": "ingress_agent" },
+        "SW": { "level": 8, "health": 80,  "distance": 40, "owner": "ingress_agent" },
+        "W":  { "level": 7, "health": 75,  "distance": 33, "owner": "ingress_agent" },
+        "NW": { "level": 6, "health": 100, "distance": 29, "owner": "ingress_agent" }
+    }
+}
+
+def full_path(portal, raw, log):
+    return portal.setStatusJson(json.loads(raw.decode('utf-8')), log)
+
+def raw_path(portal, raw, log):
+    return portal.setStatusRaw(raw, log)
+
+def run(poll, raw, polls, log):
+    portal = Portal(1, log)
+    poll(portal, raw, log)          # the first one really changes things
+    start = time.process_time()
+    for i in range(polls):
+        actions, what_changed = poll(portal, raw, log)
+        if what_changed:
+            print ("unexpected change on a steady-state portal: ", what_changed)
+            return None
+    return (time.process_time() - start) / polls
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Portal per-poll CPU cost, steady state.")
+    parser.add_argument('--polls', default=5000, type=int)
+    args = parser.parse_args(argv)
+
+    log = logging.getLogger('portalbench')
+    log.setLevel(logging.WARNING)
+
+    raw = json.dumps(steady_status).encode('utf-8')
+
+    full = run(full_path, raw, args.polls, log)
+    fast = run(raw_path, raw, args.polls, log)
+    if full is None or fast is None:
+        return 1
+
+    print ("%d polls, %d byte status" % (args.polls, len(raw)))
+    print ("json.loads + setStatusJson: %8.1f usec CPU per poll" % (full * 1e6))
+    print ("setStatusRaw:               %8.1f usec CPU per poll" % (fast * 1e6))
+    print ("speedup:                    %8.1fx" % (full / fast))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
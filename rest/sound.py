@@ -53,64 +53,36 @@ from aiohttp import web
 
 # import local shared code
 from portal import Resonator, Portal
-
-import wave
-import subprocess
-
-import platform
-
-# should do something less dumb, like checking if a file exists
-# instead of coding in something like this
-if (platform.system() == 'Darwin'):
-    command_filename_offset = 1
-    command_template = [ "afplay" ]
-elif (platform.system() == 'Linux'):
-    command_filename_offset = 1
-    command_template = [ "aplay" ]
-else:
-    print ( "unknown operating system, can't play sounds ")
-    sys.exit(0)
-
-# !!!
-# Hopefully you will find a way to play both foreground and background
-#
-
-# play a sound start, and allow killing
-def play_sound_start( filename ):
-    global command_template
-    global command_filename_offset
-
-    stat = os.stat( filename )
-
-    # let's check the length, in time
-    wf = wave.open(filename, 'rb')
-    bytes_per_second = wf.getnchannels() * wf.getframerate() * wf.getsampwidth()
-    secs = stat.st_size / bytes_per_second
-    # log.debug ("play sound start: seconds is: ",sec)
-
-    ct = list(command_template)
-    ct.insert(command_filename_offset, filename)
-    # log.debug("play sound start: passing to popen: ", ct)
-    proc = subprocess.Popen( ct )
-
-#   print (" delaying ")
-#   time.sleep( sec - 1.0 )
-#   time.sleep( 2.0 )
-
-    # test: kill the sound, todo, pass back an object that can respond to a kill
-    return proc, secs
-
-def play_sound_end( proc ):
-    proc.kill()
-
-# if a sound is older than this, it would be confusing to play it, ignore it
-maximum_age = 45.0
-
+import events
+
+import mixer
+import soundbank
+import soundqueue
+import soundindex
+
+# start a sound on the mixer, with a callback on the event loop when it has
+# played out. Returns the voice, to stop it with, and how long it lasts
+def play_sound_start( i_sound, filename ):
+    m = i_sound.app['mixer']
+    clip = i_sound.app['bank'].get( filename )
+    loop = i_sound.app['loop']
+    # the caller bumps the sequence for this sound
+    sequence = i_sound.sequence + 1
+
+    # on the mixer thread. Stopped early is not done: whoever stopped it
+    # plays the next thing
+    def done( voice ):
+        if voice.finished:
+            loop.call_soon_threadsafe(switch_sound_cb, i_sound, sequence)
+
+    voice = m.play( clip, mixer.FOREGROUND, i_sound.gains.get(filename, 1.0), done=done )
+    return voice, clip.seconds
+
+def play_sound_end( i_sound, voice ):
+    i_sound.app['mixer'].stop( voice )
 
 def switch_sound_cb(i_sound, sequence):
 
-    global maximum_age
-
     log = i_sound.log
     log.debug( " switch_sound_cb called ")
 
@@ -121,44 +93,22 @@ def switch_sound_cb(i_sound, sequence):
 
     log.debug(" killing old sound, sequence %d ",sequence)
     if (i_sound.event_audio_obj):
-        play_sound_end(i_sound.event_audio_obj)
+        play_sound_end(i_sound, i_sound.event_audio_obj)
         i_sound.clean()
 
     log.debug(" start background, or play from queue? ")
 
+    # the most important thing still worth playing, see soundqueue.py
+    s_event = i_sound.q.pop( time.time() )
+
     # nothing, play background
-    if i_sound.q.empty() :
+    if s_event is None:
         i_sound.play_background()
         return
 
-    # something on queue, play it
-    while True:
-        try:
-            s_event = i_sound.q.get_nowait()
-        except asyncio.queues.QueueEmpty:
-            # drained queue: play background: exit
-            log.warning(" ignored all elements on queue, play background ")
-
-            i_sound.play_background()
-            return
-            
-        # if ancient, drop
-        if (s_event.received_time + maximum_age < time.time() ):
-            log.warning(" ignoring sound too long on queue ")
-            continue
-
-        i_sound.play_sound_immediate(s_event)
+    i_sound.play_sound_immediate(s_event)
 
 
-# the kind of thing that should be on the queue
-# action is the STRING of the action
-# add more if you need more in your handler
-# time is the time we got it
-class SoundEvent:
-    def __init__(self, action, received_time):
-        self.action = action
-        self.received_time = received_time
-
 class IngressSound:
 
 #    actions_info = {
@@ -218,21 +168,40 @@ class IngressSound:
         self.event_audio_maximum = 0.0
         self.app = app
         self.sequence = 0
-        self.background = False # set to true if playing a background sound
         self.action = None   # the action type if something is playing
-        self.actions_sounds = app['actions_sounds']
-        self.background_sounds = app['background_sounds']
         self.log = app['log']
 
-        # the queue will hold some number of sounds, too many gets too far behind
-        self.q = asyncio.Queue(maxsize=20)
+        # only what the sound bank could load, see soundbank.py
+        bank = app['bank']
+        self.actions_sounds = { a: info for a, info in app['actions_sounds'].items() if bank.get(info[0]) }
+        self.background_sounds = [ f for f in app['background_sounds'] if bank.get(f) ]
+
+        # with sound_level_db, every action plays at that loudness, going
+        # by the sound index - if it describes the files we have
+        index = app['index']
+        level = app['config'].get("sound_level_db", None)
+        self.gains = {}
+        for a, info in self.actions_sounds.items():
+            entry = index.get(info[0])
+            if entry is None:
+                continue
+            if entry["frames"] != bank.get(info[0]).frames:
+                self.log.warning(" sound index is out of date for %s, run soundindex.py",info[0])
+            elif level is not None:
+                self.gains[info[0]] = index.gain(info[0], level)
+
+        # what waits while something plays: by priority, one of each action
+        self.q = soundqueue.SoundQueue( app['config'].get("sound_priorities") )
+
+        # the background: never stops, actions play over it, see mixer.Playlist
+        self.playlist = mixer.Playlist( app['mixer'], [ bank.get(f) for f in self.background_sounds ],
+                                        app['config'].get("sound_crossfade", 2.0) )
 
     def clean(self):
         self.event_audio_obj = None
         self.event_audio_start = 0.0
         self.event_audio_minimum = 0.0
         self.event_audio_maximum = 0.0
-        self.background = False
         self.action = None 
 
     # only to be used if you know nothing is currently playing
@@ -246,17 +215,15 @@ class IngressSound:
 
         now = time.time()
 
-        self.event_audio_obj, secs = play_sound_start( ainfo[0] )       
+        self.event_audio_obj, secs = play_sound_start( self, ainfo[0] )
         self.event_audio_start = now
-        self.event_audio_minimum = now + ainfo[1]
+        self.event_audio_minimum = now + min(ainfo[1], secs)
         self.event_audio_maximum = now + secs
         self.action = sound_event.action
         self.sequence += 1
 
-        # register a callback to switch
-        self.log.debug(" play immediate: scheduling callback for switch_sound %f seconds from now",secs)
-        loop = self.app['loop']
-        loop.call_later(secs, switch_sound_cb, self, self.sequence)
+        # switch_sound_cb is called when it has played out
+        self.log.debug(" play immediate: playing for %f seconds",secs)
 
 	# action is a string, one defined in the doc:
 	# attack, recharge, resonator_add, resonator_remove, portal_neutralized, portal_captured, 
@@ -278,98 +245,56 @@ class IngressSound:
             return
         self.log.debug(" ainfo %s",ainfo)
 
-        # special case: for attack and defend, ignore multiples
-        if (action == "attack" or action == "defend"):
-            if self.action == action:
-                self.log.warning(" ignoring duplicate %s sound ",action)
-                return
+        # the same as is playing: it's still playing, that will do
+        if self.action == action:
+            self.log.info(" ignoring duplicate %s sound ",action)
+            return
 
         now = time.time()
 
-        # if old one playing, kill it
+        # if old one playing, kill it. The background just ducks under it
         if (self.event_audio_obj):
-            if (self.background):
-                self.log.info(" killing background ")
-                play_sound_end(self.event_audio_obj)
+            if self.q.preempts(action, self.action):
+                self.log.info(" %s cuts off %s ",action,self.action)
+                play_sound_end(self, self.event_audio_obj)
                 self.clean()
 
             elif (now > self.event_audio_minimum):
                 self.log.info(" killing old sound ")
-                play_sound_end(self.event_audio_obj)
+                play_sound_end(self, self.event_audio_obj)
                 self.clean()
 
             else:
                 self.log.info(" queing sound: %s %f",action,now)
-                queue = self.q
-                queue.put_nowait( SoundEvent(action, now ) )
+                self.q.push(action, now)
                 return
 	
         # play new
-        self.event_audio_obj, secs = play_sound_start( ainfo[0] )		
+        self.event_audio_obj, secs = play_sound_start( self, ainfo[0] )
         self.event_audio_start = now
-        self.event_audio_minimum = now + ainfo[1]
+        self.event_audio_minimum = now + min(ainfo[1], secs)
         self.event_audio_maximum = now + secs
         self.action = action
         self.sequence += 1
 
-        # register a callback to switch
-        self.log.info(" playing sound, and scheduling callback for switch_sound %f seconds from now",secs)
-        loop = self.app['loop']
-        loop.call_later(secs, switch_sound_cb, self, self.sequence)
+        # switch_sound_cb is called when it has played out
+        self.log.info(" playing sound for %f seconds",secs)
 
+    # the background playlist runs for good once it's started: from here on
+    # there is always something underneath
     def play_background(self):
 
-        #
-        self.log.info(" PLAY BACKGROUND SOUND")
-
-        now = time.time()
+        if self.playlist.running:
+            return
 
-        # pick one randomly
         if len(self.background_sounds) == 0:
-            sfile = self.background_sounds[0]
-        else:
-            rand = random.randint( 0, len(self.background_sounds) - 1)
-            self.log.info(" playing random sound %d %s",rand, self.background_sounds[rand])
-            sfile = self.background_sounds[rand]
-
-        self.event_audio_obj, secs = play_sound_start( sfile )     
-        self.event_audio_start = now
-        self.event_audio_minimum = now
-        self.event_audio_maximum = now + secs
-        self.sequence += 1
-
-		# register a callback to switch
-        self.log.info(" background: scheduling callback for switch_sound %f seconds from now",secs)
-        loop = self.app['loop']
-        loop.call_later(secs, switch_sound_cb, self, self.sequence)
-
-
-
-# play a sound start, and allow killing
-def play_sound_start( filename ):
-    global command_template
-    global command_filename_offset
-
-    stat = os.stat( filename )
-
-    # let's check the length, in time
-    wf = wave.open(filename, 'rb')
-    bytes_per_second = wf.getnchannels() * wf.getframerate() * wf.getsampwidth()
-    sec = stat.st_size / bytes_per_second
-
-    ct = list(command_template)
-    ct.insert(command_filename_offset, filename)
-    proc = subprocess.Popen( ct )
-
-#   print (" delaying ")
-#   time.sleep( sec - 1.0 )
-#   time.sleep( 2.0 )
+            self.log.info(" no background sounds, quiet ")
+            return
 
-    # test: kill the sound, todo, pass back an object that can respond to a kill
-    return (proc, sec)
+        self.log.info(" PLAY BACKGROUND SOUND")
+        self.playlist.start()
+        self.log.info(" background: playing %s",self.playlist.playing())
 
-def play_sound_end( proc ):
-    proc.kill()
 
 
 # A simple example of a timer function
@@ -393,6 +318,20 @@ async def timer(app):
 # you manipulate it.
 #
 
+# a notification, posted to /portal or off the Jarvis event stream
+def handle_notification(app, req_obj):
+    log = app['log']
+    sound = app['sound']
+
+    # one 'action', or a batch of 'actions' in order
+    action_strs = req_obj.get("actions", None)
+    if action_strs is None:
+        action_strs = [ req_obj.get("action", None) ]
+
+    for action_str in action_strs:
+        log.debug(" action is: %s sound is: %s",action_str, sound)
+        sound.play_action_str(action_str)
+
 # this needs UTF8 because names might have utf8
 # 
 # ENTRY POINT where Jarvis calls me
@@ -408,11 +347,7 @@ async def portal_notification(request):
         req_obj = await request.json()
         log.debug(" received JSON %s",req_obj)
 
-        action_str = req_obj.get("action", None)
-
-        log.debug(" action is: %s sound is: %s",action_str, sound)
-
-        sound.play_action_str(action_str)
+        handle_notification(request.app, req_obj)
 
         r = web.Response(text="OK" , charset='utf-8')
     except:
@@ -436,12 +371,25 @@ async def health(request):
 # Whatever tasks you create here will be executed and cancelled properly
 
 async def start_background_tasks(app):
+    app['mixer'].start()
+    app['bank'].start(app['mixer'])
+    app['sound'].play_background()
     app['timer_task'] = app.loop.create_task( timer(app) )
+    # follow the Jarvis event stream instead of waiting for posts
+    g_config = app['config']
+    if "sound_url" in g_config.get("stream_drivers", []):
+        app['events_task'] = app.loop.create_task( events.follow(g_config["jarvis_events_url"],
+                        functools.partial(handle_notification, app), app['log']) )
 
 async def cleanup_background_tasks(app):
     app['log'].info(" cleaning up background tasks ")
     app['timer_task'].cancel()
     await app['timer_task']
+    if 'events_task' in app:
+        app['events_task'].cancel()
+    app['sound'].playlist.stop()
+    app['mixer'].close()
+    app['bank'].close()
 
 def create_logger(args):
     # create a logging object and add it to the app object
@@ -474,6 +422,19 @@ async def init(app, args, loop):
     # create a portal object and stash it, many will need it
     app['portal'] = Portal(1, app['log'])
 
+    # one output stream for every sound, see mixer.py. "sound_sink" is
+    # "device", "null", or a WAV file to write instead
+    g_config = app['config']
+    sink = mixer.create_sink(g_config.get("sound_sink", "device"), 44100, 2)
+    app['mixer'] = mixer.Mixer(sink, 44100, 2, duck=g_config.get("sound_duck", 0.3), log=app['log'])
+
+    # lengths and loudness of the sounds, worked out ahead, see soundindex.py
+    app['index'] = soundindex.SoundIndex(g_config.get("sound_index", "../audio/index.json"), app['log'])
+
+    # every sound there is to play, read in now rather than when it's played
+    app['bank'] = soundbank.SoundBank(44100, 2, app['log'])
+    app['bank'].load_all( [ info[0] for info in app['actions_sounds'].values() ] + app['background_sounds'] )
+
     # An Object For Sound
     app['sound'] = IngressSound(app)
 
@@ -528,8 +489,8 @@ elif g_config['sound_type'] == 'test':
     app['background_sounds'] = IngressSound.background_sounds_test
 else:
     log.warning(" Sound Type %s NOT SUPPORTED", g_config['sound_type'])
-    app['action_sounds'] = None
-    app['background_sounds'] = None
+    app['actions_sounds'] = {}
+    app['background_sounds'] = []
 
 loop.run_until_complete(init(app, args, loop))
 
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+### VERY MUCH PYTHON 3 !!!
+
+#
+# Every sound the sound service can play, opened once at startup.
+#
+# The WAV files are memory mapped, and a clip's PCM is a numpy view straight
+# onto the mapping - no copy, no decode, it's 16 bit PCM already. Short
+# clips (the actions) are then read in whole, so after startup playing one
+# touches the SD card not at all. Long ones (background tracks) stay
+# mapped and are streamed: the kernel is told they are read front to
+# back, the first few seconds are read at startup, and a readahead thread
+# keeps reading a few seconds ahead of wherever they are playing.
+#
+# Loading checks the format (16 bit PCM, the mixer's rate, mono or the
+# mixer's channels); a file that fails is logged and left out.
+#
+# Usage:
+#   bank = SoundBank(44100, 2, log)
+#   bank.load_all(filenames)        # gives back the ones that failed
+#   clip = bank.get(filename)
+#   bank.start(mixer)               # the readahead
+#
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy
+
+from mixer import Clip
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# the format, and where the samples are: ((tag, channels, rate, bits), offset, size)
+def read_header(filename):
+    with open(filename, 'rb') as f:
+        riff, riff_size, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError("%s: not a WAV file" % filename)
+        fmt = None
+        while True:
+            head = f.read(8)
+            if len(head) < 8:
+                raise ValueError("%s: no data chunk" % filename)
+            chunk_id, chunk_size = struct.unpack('<4sI', head)
+            if chunk_id == b'fmt ':
+                body = f.read(chunk_size)
+                tag, channels, rate, byte_rate, align, bits = struct.unpack('<HHIIHH', body[:16])
+                if tag == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                    tag = struct.unpack('<H', body[24:26])[0]
+                fmt = (tag, channels, rate, bits)
+                f.seek(chunk_size & 1, 1)
+            elif chunk_id == b'data':
+                if fmt is None:
+                    raise ValueError("%s: data before fmt" % filename)
+                offset = f.tell()
+                # some writers leave the size at 0, or too big: take what is there
+                left = os.fstat(f.fileno()).st_size - offset
+                size = min(chunk_size, left) if chunk_size else left
+                return fmt, offset, size
+            else:
+                f.seek(chunk_size + (chunk_size & 1), 1)
+
+class SoundBank:
+
+    def __init__(self, rate, channels, log, stream_bytes=8*1024*1024, readahead=4.0):
+        self.rate = rate
+        self.channels = channels
+        self.log = log
+        self.stream_bytes = stream_bytes    # files bigger than this are streamed
+        self.readahead = readahead          # seconds
+        self.clips = {}
+        self.failed = {}                    # filename -> why
+        self.thread = None
+        self.running = False
+
+    def load(self, filename):
+        (tag, channels, rate, bits), offset, size = read_header(filename)
+        if tag != WAVE_FORMAT_PCM or bits != 16:
+            raise ValueError("%s: only 16 bit PCM is supported" % filename)
+        if rate != self.rate:
+            raise ValueError("%s: %d Hz, the mixer runs at %d" % (filename, rate, self.rate))
+        if channels != 1 and channels != self.channels:
+            raise ValueError("%s: %d channels, need 1 or %d" % (filename, channels, self.channels))
+
+        frames = size // (2 * channels)
+        with open(filename, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        streamed = size > self.stream_bytes
+        if streamed and hasattr(mapped, 'madvise'):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        pcm = numpy.frombuffer(mapped, dtype='<i2', count=frames * channels, offset=offset)
+        pcm = pcm.reshape(frames, channels)
+        if not streamed:
+            # small: in memory for good, and the file is done with
+            pcm = pcm.copy()
+            mapped.close()
+        if channels == 1:
+            # still no copy: the one channel, seen as many
+            pcm = numpy.broadcast_to(pcm, (frames, self.channels))
+
+        clip = Clip(filename, pcm, rate)
+        clip.streamed = streamed
+        if streamed:
+            warm(clip, 0, int(self.readahead * rate))
+        return clip
+
+    # load everything there is to play; gives back the ones that failed
+    def load_all(self, filenames):
+        for filename in filenames:
+            if filename in self.clips or filename in self.failed:
+                continue
+            try:
+                self.clips[filename] = self.load(filename)
+            except Exception as ex:
+                self.failed[filename] = str(ex)
+                self.log.warning(" sound bank: can't use %s: %s",filename,str(ex))
+        return [ f for f in filenames if f in self.failed ]
+
+    # loaded already, or None: nothing is read from disk here
+    def get(self, filename):
+        return self.clips.get(filename)
+
+    def start(self, mixer):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, args=(mixer,), name="soundbank", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # keep the streamed clips that are playing read ahead of the mixer
+    def run(self, mixer):
+        ahead = int(self.readahead * self.rate)
+        read_to = {}            # voice -> the frame it has been read up to
+        while self.running:
+            playing = [ v for v in mixer.playing() if v.clip.streamed ]
+            read_to = { v: read_to.get(v, 0) for v in playing }
+            for v in playing:
+                if read_to[v] < v.pos + ahead:
+                    warm(v.clip, max(v.pos, read_to[v]), v.pos + ahead)
+                    read_to[v] = v.pos + ahead
+            time.sleep(self.readahead / 4)
+
+    def stats(self):
+        resident = sum(c.pcm.nbytes for c in self.clips.values() if not c.streamed)
+        return { 'clips': len(self.clips), 'streamed': sum(1 for c in self.clips.values() if c.streamed),
+                 'resident_bytes': resident, 'failed': dict(self.failed) }
+
+# read a clip's frames from start to end, a page at a time, so they are in
+# memory before the mixer wants them
+def warm(clip, start, end):
+    step = max(1, mmap.PAGESIZE // clip.pcm.strides[0])
+    end = min(end, clip.frames)
+    if start < end:
+        int(clip.pcm[start:end:step, 0].sum())
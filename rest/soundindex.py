@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+### VERY MUCH PYTHON 3 !!!
+
+#
+# The sound index: what is known about every WAV in the audio directory,
+# worked out once, when the audio is installed, rather than by the sound
+# service. One compact JSON file, next to the sounds:
+#   { "version": 1, "sounds": { "test/attack.wav": {
+#       "seconds": 2.789, "frames": 123012, "rate": 44100, "channels": 2,
+#       "bits": 16, "bytes": 492092, "peak_db": -0.4, "rms_db": -17.9,
+#       "sha1": "..." }, ... } }
+# Names are relative to the index's directory. Loudness is in dB from full
+# scale: the highest sample, and the RMS over the whole sound.
+#
+# The sound service loads it at startup (sound_index in the config). It
+# uses the lengths to keep minimum play times within the sounds, and, if
+# sound_level_db is set, the loudness to play every action at that level.
+#
+# Sample usage, whenever the audio changes:
+# $ python soundindex.py ../audio
+# $ python soundindex.py ../audio --out /tmp/index.json
+#
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+
+import numpy
+
+from soundbank import read_header
+
+VERSION = 1
+
+def decibels(value):
+    if value <= 0:
+        return -120.0
+    return round(20.0 * math.log10(value / 32768.0), 1)
+
+def describe(filename):
+    (tag, channels, rate, bits), offset, size = read_header(filename)
+    entry = { "rate": rate, "channels": channels, "bits": bits,
+              "bytes": os.stat(filename).st_size }
+    with open(filename, 'rb') as f:
+        data = f.read()
+    entry["sha1"] = hashlib.sha1(data).hexdigest()
+    frames = size // max(1, channels * bits // 8)
+    entry["frames"] = frames
+    entry["seconds"] = round(frames / rate, 3)
+    if tag == 1 and bits == 16 and frames > 0:
+        pcm = numpy.frombuffer(data, dtype='<i2', count=frames * channels, offset=offset).astype(numpy.float64)
+        entry["peak_db"] = decibels(numpy.abs(pcm).max())
+        entry["rms_db"] = decibels(math.sqrt(numpy.mean(pcm * pcm)))
+    return entry
+
+def build_index(directory):
+    sounds = {}
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.lower().endswith(".wav"):
+                continue
+            filename = os.path.join(root, name)
+            key = os.path.relpath(filename, directory).replace(os.sep, "/")
+            try:
+                sounds[key] = describe(filename)
+            except Exception as ex:
+                print ("skipping", filename, ":", ex)
+    return { "version": VERSION, "sounds": sounds }
+
+#
+# The service side
+#
+class SoundIndex:
+
+    def __init__(self, filename=None, log=None):
+        self.directory = None
+        self.sounds = {}
+        if filename is None:
+            return
+        try:
+            with open(filename) as f:
+                index = json.load(f)
+            if index.get("version") != VERSION:
+                raise ValueError("version %s, need %d" % (index.get("version"), VERSION))
+            self.sounds = index["sounds"]
+            self.directory = os.path.dirname(os.path.abspath(filename))
+        except Exception as ex:
+            if log:
+                log.warning(" sound index %s not used: %s",filename,str(ex))
+
+    # what the index says about a sound file, or None
+    def get(self, filename):
+        if self.directory is None:
+            return None
+        key = os.path.relpath(os.path.abspath(filename), self.directory).replace(os.sep, "/")
+        return self.sounds.get(key)
+
+    # the gain that plays filename at level_db RMS, without clipping it
+    def gain(self, filename, level_db):
+        entry = self.get(filename)
+        if entry is None or "rms_db" not in entry:
+            return 1.0
+        db = min(level_db - entry["rms_db"], -entry["peak_db"])
+        return 10.0 ** (db / 20.0)
+
+    def __len__(self):
+        return len(self.sounds)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Write the sound index for an audio directory.")
+    parser.add_argument('directory')
+    parser.add_argument('--out', help="default: index.json in the directory", default=None)
+    args = parser.parse_args(argv)
+
+    out = args.out or os.path.join(args.directory, "index.json")
+    index = build_index(args.directory)
+    tmp = out + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f, sort_keys=True, separators=(',', ':'))
+    os.replace(tmp, out)
+    print ("%d sounds indexed in %s" % (len(index["sounds"]), out))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+### VERY MUCH PYTHON 3 !!!
+
+#
+# What the sound service plays next, when something is already playing.
+#
+# Each action has a priority and a staleness: how long after it happened it
+# is still worth playing. Pending actions are kept one per action - a burst
+# of the same action (an attack is dozens of them) becomes one sound. The
+# next one out is the most important that isn't stale, oldest first among
+# equals; stale ones are dropped. An action more important than the one
+# playing doesn't wait for it at all, see preempts().
+#
+# So under a flood of attacks the sound keeps up with the portal: at most
+# one attack waits, and only for a couple of seconds.
+#
+# Usage:
+#   q = SoundQueue(priorities)
+#   q.push("attack", time.time())
+#   action = q.pop(time.time())     # None if there is nothing worth playing
+#
+
+import itertools
+
+# action: (priority, seconds it stays worth playing). Higher goes first.
+default_priorities = {
+    'portal_captured':      (4, 10.0),
+    'portal_neutralized':   (4, 10.0),
+    'virus_jarvis':         (3, 8.0),
+    'virus_ada':            (3, 8.0),
+    'resonator_add':        (2, 5.0),
+    'resonator_remove':     (2, 5.0),
+    'resonator_upgrade':    (2, 5.0),
+    'mod_added':            (2, 5.0),
+    'mod_destroyed':        (2, 5.0),
+    'attack':               (1, 2.0),
+    'recharge':             (1, 2.0),
+}
+
+class PendingSound:
+
+    def __init__(self, action, received_time, order):
+        self.action = action
+        self.first_time = received_time
+        self.received_time = received_time      # the latest of the burst
+        self.order = order
+        self.count = 1
+
+class SoundQueue:
+
+    def __init__(self, priorities=None):
+        self.priorities = dict(default_priorities)
+        if priorities:
+            self.priorities.update( { a: tuple(p) for a, p in priorities.items() } )
+        self.pending = {}                       # action -> PendingSound
+        self.order = itertools.count()
+        self.pushed = 0
+        self.coalesced = 0
+        self.stale = 0
+
+    def priority(self, action):
+        return self.priorities.get(action, (0, 2.0))[0]
+
+    def max_age(self, action):
+        return self.priorities.get(action, (0, 2.0))[1]
+
+    # true if action should cut off what is playing now
+    def preempts(self, action, playing):
+        return playing is None or self.priority(action) > self.priority(playing)
+
+    def push(self, action, received_time):
+        self.pushed += 1
+        p = self.pending.get(action)
+        if p is not None:
+            # the same again: still one sound, but fresh
+            p.received_time = received_time
+            p.count += 1
+            self.coalesced += 1
+            return
+        self.pending[action] = PendingSound(action, received_time, next(self.order))
+
+    def pop(self, now):
+        for action, p in list(self.pending.items()):
+            if p.received_time + self.max_age(action) < now:
+                del self.pending[action]
+                self.stale += 1
+        if not self.pending:
+            return None
+        p = min(self.pending.values(), key=lambda p: (-self.priority(p.action), p.order))
+        del self.pending[p.action]
+        return p
+
+    def empty(self):
+        return len(self.pending) == 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def stats(self):
+        return { 'pending': sorted(self.pending), 'pushed': self.pushed,
+                 'coalesced': self.coalesced, 'stale': self.stale }
@@ -49,6 +49,8 @@ import textwrap
 
 from aiohttp import web
 
+from portal import snapshot_response
+
 
 # Polling the simulator to see what has changed
 
@@ -72,11 +74,10 @@ async def timer(app):
 
 # this needs UTF8 because names might have utf8
 async def statusJson(request):
-    portal = request.app['portal']
-    portal_str = ""
-    with portal.lock:
-        portal_str = str(portal)
-    return web.Response(text=portal_str , charset='utf-8')
+    # the current snapshot: no lock, it never changes under us, and it
+    # only serializes itself once
+    snap = request.app['portal'].snapshot
+    return snapshot_response(request, snap.tobytes(), snap.etag())
 
 async def hello(request):
     return web.Response(text="Welcome to Magnus Flora Template! Please replace me.")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+### VERY MUCH PYTHON 3 !!!
+
+#
+# Checks that simulation files replay through the shared portal model
+# (portal.py, a link to rest/portal.py) the way the simulator always
+# played them:
+#   - lines are deltas: reso_add.json builds up to eight resonators
+#   - a neutral portal can't have resonators or mods: those lines are
+#     rejected, and the portal stays as it was
+#
+# Standalone, no simulator or Jarvis needed. Exits 1 on any failure.
+# Sample usage:
+# $ python simcheck.py
+#
+
+import logging
+import sys
+
+from portal import Portal
+
+def state(p):
+    return (p.faction, p.level, p.health,
+            sorted((pos, r.level, r.health) for pos, r in p.resonators.items()), list(p.mods))
+
+# replay filename up to and including line 'upto' (1-based, as in an editor);
+# gives back the state before and after that line
+def replay(filename, upto=None):
+    p = Portal(1, logging.getLogger("simcheck"))
+    before = state(p)
+    with open(filename) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if len(line) == 0 or line[0] == '#':
+                continue
+            before = state(p)
+            try:
+                p.setStatusFile(line, number)
+            except Exception:
+                pass
+            if number == upto:
+                break
+    return before, state(p)
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    failed = 0
+
+    before, after = replay("reso_add.json")
+    expected = [ (pos, 4, 100) for pos in sorted(Portal.valid_positions) ]
+    if after[3] != expected:
+        print ("FAILED: reso_add.json ends with", after[3])
+        failed += 1
+
+    # eight level 8 resonators, or a mod, on a neutral portal
+    for filename, line in [ ("anomaly_mode_sim.json", 19), ("portal_test2.json", 52) ]:
+        before, after = replay(filename, line)
+        if before[0] != 0 or after != before:
+            print ("FAILED: %s line %d was applied to a neutral portal: %s" % (filename, line, after))
+            failed += 1
+
+    if failed:
+        return 1
+    print ("simulation files: all good")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())